@@ -0,0 +1,82 @@
+"""
+    Micro-benchmark of the record conversion on a wide keyword report.
+    Compare the per-cell converting_value loop with RecordConverter, and with FrameConverter (pandas engine) by batches of FRAME_ROWS rows.
+
+    python benchmarks/bench_converter.py [rows]
+"""
+import csv
+import io
+import random
+import sys
+import time
+import pandas
+from tap_searchads360.streams import SearchAdsStream, RecordConverter, converting_value
+from tap_searchads360.frames import FrameConverter, FRAME_ROWS
+from tap_searchads360.writer import encoder
+
+SAMPLES = {
+    'string': lambda: random.choice(['Active', 'Paused', 'Removed', 'broad', 'exact']),
+    'integer': lambda: str(random.randint(1, 10 ** 12)),
+    'number': lambda: f'{random.random() * 100:.2f}',
+    'boolean': lambda: random.choice(['true', 'false']),
+}
+EMPTY_RATE = 0.1
+
+
+def sample_lines(schema, columns, rows):
+    dates = [f'2020-{month:02}-{day:02}' for month in range(1, 13) for day in range(1, 29)]
+    generators = []
+    for column in columns:
+        type = schema['properties'][column]
+        if type.get('format') == 'date-time':
+            generators.append(lambda: random.choice(dates))
+        else:
+            generators.append(SAMPLES.get(type['type'][1], SAMPLES['string']))
+    return [[generator() if random.random() > EMPTY_RATE else '' for generator in generators] for _ in range(rows)]
+
+
+def sample_frame(lines, dtypes):
+    # typed as read_frames parses them
+    text = io.StringIO()
+    csv.writer(text).writerows(lines)
+    text.seek(0)
+    columns = range(len(lines[0]))
+    return pandas.read_csv(text, header=None, dtype={index: dtypes.get(index, object) for index in columns}, keep_default_na=False,
+                           na_values={index: [''] for index in dtypes}, float_precision='round_trip')
+
+
+def run(name, convert, lines, rows=None):
+    start = time.perf_counter()
+    for line in lines:
+        convert(line)
+    duration = time.perf_counter() - start
+    print(f'{name:<20} {(rows or len(lines)) / duration:>12,.0f} rows/sec')
+    return duration
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    stream = SearchAdsStream('keyword', config={'custom_report': []})
+    schema = stream.load_schema()
+    columns = list(schema['properties'])
+    lines = sample_lines(schema, columns, rows)
+    print(f'keyword report: {rows} rows, {len(columns)} columns')
+
+    properties = schema['properties']
+    before = run('converting_value', lambda line: {key: (converting_value(value, properties[key]) if value else None) for (key, value) in zip(columns, line)}, lines)
+    converter = RecordConverter(schema, columns)
+    after = run('RecordConverter', converter, lines)
+    print(f'speedup: x{before / after:.1f}')
+
+    # conversion and json of the records, as written by RecordWriter
+    record_json = run('RecordConverter+json', lambda line: encoder.encode(converter(line)), lines)
+    frame_converter = FrameConverter(RecordConverter(schema, columns))
+    frames = [sample_frame(lines[start:start + FRAME_ROWS], frame_converter.dtypes) for start in range(0, rows, FRAME_ROWS)]
+    frame_json = run('FrameConverter', frame_converter.serialize, frames, rows=rows)
+    print(f'speedup: x{record_json / frame_json:.1f}')
+    records = [record for frame in frames for record in frame_converter.serialize(frame)]
+    assert records == [encoder.encode(converter(line)) for line in lines], 'FrameConverter records differ from RecordConverter'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+    Startup time of `tap-searchads360 --discover`, in a new process each run.
+
+    python benchmarks/bench_discover.py [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CONFIG = {
+    'client_id': 'bench',
+    'client_secret': 'bench',
+    'refresh_token': 'bench',
+    'start_date': '2020-01-01',
+    'agency_id': 1,
+    'advertiser_id': [1]
+}
+# discover without the oauth round-trip of main()
+SCRIPT = 'import sys, singer, tap_searchads360; tap_searchads360.discover(config=singer.utils.parse_args([]).config)'
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(CONFIG, f)
+    try:
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', SCRIPT, '--config', f.name, '--discover'], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            durations.append(time.perf_counter() - start)
+    finally:
+        os.remove(f.name)
+    durations.sort()
+    print(f'discover: {runs} runs, min {durations[0] * 1000:.0f}ms, median {durations[len(durations) // 2] * 1000:.0f}ms, max {durations[-1] * 1000:.0f}ms')
+
+
+if __name__ == '__main__':
+    main()
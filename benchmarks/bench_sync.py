@@ -0,0 +1,167 @@
+"""
+    End to end benchmark of tap_searchads360.sync against the local mock API (benchmarks/mock_server.py, run in its own process).
+    For each stream: records, rows/sec, wall time, http requests and peak RSS, written as JSON to track regressions.
+    Each stream is synced in a new process, its peak RSS is not the one of the streams before it.
+
+    python benchmarks/bench_sync.py --streams keyword campaign --rows 200000 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+import requests
+from singer.catalog import Catalog
+import tap_searchads360
+import tap_searchads360.client as client_module
+from tap_searchads360.client import GoogleSearchAdsClient
+from tap_searchads360.streams import SearchAdsStream, AVAILABLE_STREAMS
+
+MOCK_SERVER = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'mock_server.py')
+
+
+class CountingOutput:
+    """ stdout of the tap: counts the messages instead of printing them, write_delay seconds per write like a slow target """
+    def __init__(self, write_delay=0.0):
+        self.messages = {}
+        self.bytes = 0
+        self.write_delay = write_delay
+
+    def write(self, text):
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        self.bytes += len(text)
+        for line in text.splitlines():
+            kind = line[10:16] # {"type": "RECORD"
+            self.messages[kind] = self.messages.get(kind, 0) + 1
+        return len(text)
+
+    def flush(self):
+        pass
+
+    @property
+    def records(self):
+        return self.messages.get('RECORD', 0)
+
+
+def get_catalog(name, config):
+    catalog = Catalog.from_dict(tap_searchads360.get_catalog([SearchAdsStream(name, config=config)]))
+    for stream in catalog.streams:
+        for entry in stream.metadata:
+            if not entry['breadcrumb']:
+                entry['metadata']['selected'] = True
+    return catalog
+
+
+def peak_rss_mb():
+    # kilobytes on linux, the peak of the whole process: only measured in the process of a single stream
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def start_mock_server(args):
+    options = ['--port', '0', '--rows', str(args.rows), '--files', str(args.files), '--ready-after', str(args.ready_after),
+               '--latency', str(args.latency), '--error-rate-429', str(args.error_rate_429), '--error-rate-401', str(args.error_rate_401), '--quota', str(args.quota)]
+    process = subprocess.Popen([sys.executable, MOCK_SERVER] + options, stdout=subprocess.PIPE, text=True)
+    url = process.stdout.readline().strip()
+    return process, url
+
+
+def run_stream(name, config, url, write_delay=0.0):
+    client = GoogleSearchAdsClient(config['client_id'], config['client_secret'], config['refresh_token'],
+                                   polling_options={'first_delay': 0.1, 'max_delay': 1}, token_cache=config.get('token_cache'))
+    catalog = get_catalog(name, config)
+    output = CountingOutput(write_delay)
+    requests.get(url + '/stats')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        with client:
+            tap_searchads360.sync(client=client, config=config, catalog=catalog, state={})
+            connections = client.connection_stats()
+    wall_time = time.perf_counter() - start
+    counts = requests.get(url + '/stats').json()
+    return {
+        'stream': name,
+        'records': output.records,
+        'output_bytes': output.bytes,
+        'wall_time': round(wall_time, 3),
+        'rows_per_sec': round(output.records / wall_time, 1) if wall_time else None,
+        'http_requests': sum(count for kind, count in counts.items() if kind not in ('429', '401')),
+        'http_requests_by_kind': counts,
+        'connections': connections,
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def run_stream_process(name, config, url, write_delay=0.0):
+    """ run_stream in a new process, started without the memory of the previous streams """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_in_process, (name, config, url, write_delay))
+
+
+def run_in_process(name, config, url, write_delay):
+    logging.disable(logging.INFO)
+    client_module.BASE_API_URL = url + '/reports'
+    client_module.GOOGLE_TOKEN_URI = url + '/token'
+    return run_stream(name, config, url, write_delay=write_delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', nargs='+', default=['keyword'], choices=AVAILABLE_STREAMS)
+    parser.add_argument('--rows', type=int, default=100000, help='rows per report')
+    parser.add_argument('--files', type=int, default=1, help='files per report')
+    parser.add_argument('--advertisers', type=int, default=1)
+    parser.add_argument('--days', type=int, default=30, help='days of data to sync')
+    parser.add_argument('--ready-after', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate-401', type=float, default=0.0)
+    parser.add_argument('--quota', type=int, default=0, help='api calls per second of the mock api, 0 for no quota')
+    parser.add_argument('--write-delay', type=float, default=0.0, help='seconds per write to stdout, to simulate a slow target')
+    parser.add_argument('--config', help='json of extra tap config keys, e.g. {"file_workers": 4}')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    # the tap logs would be part of the measure
+    logging.disable(logging.INFO)
+    server, url = start_mock_server(args)
+
+    end_date = time.strftime('%Y-%m-%d', time.gmtime(time.time() - 86400))
+    start_date = time.strftime('%Y-%m-%d', time.gmtime(time.time() - 86400 * (args.days + 1)))
+    config = {
+        'client_id': 'bench',
+        'client_secret': 'bench',
+        'refresh_token': 'bench',
+        'agency_id': 1,
+        'advertiser_id': [str(advertiser_id) for advertiser_id in range(1, args.advertisers + 1)],
+        'start_date': start_date,
+        'end_date': end_date,
+        'full_table_replication': True
+    }
+    if args.config:
+        config.update(json.loads(args.config))
+
+    results = {'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'streams': []}
+    try:
+        for name in args.streams:
+            result = run_stream_process(name, config, url, write_delay=args.write_delay)
+            results['streams'].append(result)
+            print(f"{name:<25} {result['records']:>10} records {result['rows_per_sec']:>12,.0f} rows/sec "
+                  f"{result['wall_time']:>8.2f}s {result['http_requests']:>5} requests {result['peak_rss_mb']:>8.1f}MB", file=sys.stderr)
+    finally:
+        server.terminate()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""
+    Local stand-in of the Search Ads 360 Reports API, for benchmarks without network access.
+
+    - POST /token               oauth refresh
+    - POST /reports             request a report, returns its id
+    - GET  /reports/<id>        report status, ready after ready_after seconds
+    - GET  /files/<id>/<index>  synthetic csv file, generated from the schema of the report type (Range supported)
+    - GET  /stats               requests received by kind since the last call
+
+    Errors: --latency, --error-rate-429/--error-rate-401 for random errors, --quota for a 429 above n calls per second.
+
+    python benchmarks/mock_server.py --port 8360 --rows 100000
+"""
+import argparse
+import csv
+import io
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tap_searchads360.streams import get_schema
+
+SAMPLES = {
+    'string': lambda rng: rng.choice(['Active', 'Paused', 'Removed', 'broad', 'exact', 'Google', 'Bing']),
+    'integer': lambda rng: str(rng.randint(1, 10 ** 12)),
+    'number': lambda rng: f'{rng.random() * 100:.2f}',
+    'boolean': lambda rng: rng.choice(['true', 'false']),
+}
+
+
+def generate_csv(report, index, rows, seed=0):
+    """ csv content of a report file, the same for each download of the file """
+    # a generator of its own: the random errors of the handler threads don't change the content
+    rng = random.Random(f"{seed}-{report['id']}-{index}")
+    columns = [column['columnName'] for column in report['body']['columns']]
+    properties = get_schema(report['body']['reportType'])['properties']
+    start = datetime.strptime(report['body']['timeRange']['startDate'], '%Y-%m-%d')
+    days = max((datetime.strptime(report['body']['timeRange']['endDate'], '%Y-%m-%d') - start).days, 1)
+    dates = [(start + timedelta(days=day)).strftime('%Y-%m-%d') for day in range(days + 1)]
+
+    generators = []
+    for column in columns:
+        type = properties.get(column, {'type': ['null', 'string']})
+        if type.get('format') == 'date-time':
+            generators.append(lambda rng: rng.choice(dates))
+        else:
+            generators.append(SAMPLES.get(type['type'][1], SAMPLES['string']))
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(columns)
+    for _ in range(rows):
+        writer.writerow([generator(rng) for generator in generators])
+    return output.getvalue().encode('utf-8')
+
+
+class MockSearchAds:
+    """ State of the mock API, shared by the request handlers """
+    def __init__(self, rows=10000, files=1, ready_after=0.5, latency=0.0, error_rate_429=0.0, error_rate_401=0.0, token_lifetime=3600, quota=0):
+        self.rows = rows
+        self.files = files
+        self.ready_after = ready_after
+        self.latency = latency
+        self.error_rate_429 = error_rate_429
+        self.error_rate_401 = error_rate_401
+        self.token_lifetime = token_lifetime
+        # api calls per second, the calls above get a 429
+        self.quota = quota
+        self.calls = []
+        self.reports = {}
+        self.contents = {}
+        self.requests = {}
+        self.lock = threading.Lock()
+
+    def count(self, kind):
+        with self.lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def over_quota(self):
+        if not self.quota:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            self.calls = [call for call in self.calls if now - call < 1]
+            if len(self.calls) >= self.quota:
+                return True
+            self.calls.append(now)
+            return False
+
+    def reset_counts(self):
+        with self.lock:
+            counts, self.requests = self.requests, {}
+        return counts
+
+    def create_report(self, body):
+        with self.lock:
+            report_id = f'mock{len(self.reports) + 1}'
+            self.reports[report_id] = {'id': report_id, 'body': body, 'created': time.monotonic()}
+        return report_id
+
+    def get_file(self, report_id, index):
+        key = (report_id, index)
+        with self.lock:
+            content = self.contents.get(key)
+        if content is None:
+            report = self.reports[report_id]
+            rows = self.rows // self.files + (1 if index < self.rows % self.files else 0)
+            content = generate_csv(report, index, rows)
+            with self.lock:
+                self.contents[key] = content
+        return content
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def api(self):
+        return self.server.api
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, {'error': {'code': status, 'errors': [{'message': message}]}})
+
+    def injected_error(self):
+        if self.api.latency:
+            time.sleep(self.api.latency)
+        if random.random() < self.api.error_rate_429 or self.api.over_quota():
+            self.api.count('429')
+            self.send_error_json(429, 'Rate limit exceeded')
+            return True
+        if random.random() < self.api.error_rate_401:
+            self.api.count('401')
+            self.send_error_json(401, 'Invalid Credentials')
+            return True
+        return False
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/token'):
+            self.api.count('token')
+            return self.send_json(200, {'access_token': 'mock-token', 'expires_in': self.api.token_lifetime, 'token_type': 'Bearer'})
+        if self.path.startswith('/reports'):
+            self.api.count('request_report')
+            if self.injected_error():
+                return
+            return self.send_json(202, {'kind': 'doubleclicksearch#report', 'id': self.api.create_report(json.loads(body))})
+        self.send_error_json(404, 'Not found')
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts[0] == 'stats':
+            return self.send_json(200, self.api.reset_counts())
+        if parts[0] == 'reports' and len(parts) == 2:
+            self.api.count('process_files')
+            if self.injected_error():
+                return
+            report = self.api.reports.get(parts[1])
+            if not report:
+                return self.send_error_json(404, 'Report not found')
+            if time.monotonic() - report['created'] < self.api.ready_after:
+                return self.send_json(200, {'id': report['id'], 'isReportReady': False})
+            host = self.headers.get('Host')
+            files = [{'url': f'http://{host}/files/{report["id"]}/{index}', 'byteCount': 0} for index in range(self.api.files)]
+            return self.send_json(200, {'id': report['id'], 'isReportReady': True, 'files': files})
+        if parts[0] == 'files' and len(parts) == 3:
+            self.api.count('download')
+            if self.injected_error():
+                return
+            content = self.api.get_file(parts[1], int(parts[2]))
+            start = 0
+            if self.headers.get('Range', '').startswith('bytes='):
+                start = int(self.headers['Range'][len('bytes='):].split('-')[0])
+            self.send_response(206 if start else 200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', str(len(content) - start))
+            self.end_headers()
+            self.wfile.write(content[start:])
+            return
+        self.send_error_json(404, 'Not found')
+
+
+def start_server(api, port=0):
+    """ Start the mock API in a background thread, returns the server and its base url """
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockHandler)
+    server.daemon_threads = True
+    server.api = api
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8360, help='0 for any free port')
+    parser.add_argument('--rows', type=int, default=10000, help='rows per report')
+    parser.add_argument('--files', type=int, default=1, help='files per report')
+    parser.add_argument('--ready-after', type=float, default=0.5, help='seconds before a report is ready')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each api call')
+    parser.add_argument('--error-rate-429', type=float, default=0.0)
+    parser.add_argument('--error-rate-401', type=float, default=0.0)
+    parser.add_argument('--quota', type=int, default=0, help='api calls per second before a 429, 0 for no quota')
+    args = parser.parse_args()
+    api = MockSearchAds(rows=args.rows, files=args.files, ready_after=args.ready_after, latency=args.latency,
+                        error_rate_429=args.error_rate_429, error_rate_401=args.error_rate_401, quota=args.quota)
+    server, url = start_server(api, port=args.port)
+    # first line is read by bench_sync.py
+    print(url, flush=True)
+    print(f'Mock Search Ads 360 API: token {url}/token, reports {url}/reports', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,6 +14,9 @@ setup(
         'requests>=2.20.0',
         'pandas>=0.23.4'
     ],
+    extras_require={
+        'async': ['aiohttp>=3.7']
+    },
     entry_points='''
         [console_scripts]
         tap-searchads360=tap_searchads360:main
@@ -1,8 +1,13 @@
+import argparse
 import json
 import singer
 import sys
-from .client import GoogleSearchAdsClient
+from .client import GoogleSearchAdsClient, DEFAULT_POOL_SIZE
 from .streams import SearchAdsStream, AVAILABLE_STREAMS
+from .scheduler import ReportScheduler, DEFAULT_MAX_WORKERS
+from .cache import ReportCache, DEFAULT_TTL, DEFAULT_MAX_SIZE
+from .stats import SyncStats
+from .ratelimit import RateLimiter, DEFAULT_RATE, DEFAULT_BURST
 
 logger = singer.get_logger()
 REQUIRED_CONFIG_KEYS = ['client_id', 'client_secret', 'refresh_token', 'start_date', 'agency_id']
@@ -26,29 +31,74 @@ def get_catalog(streams):
 
 def discover(config=None):
     logger.info('Starting discover ..')
-    streams = [SearchAdsStream(stream_name, config=config) for stream_name in AVAILABLE_STREAMS]
+    # each stream is built when its catalog entry is written
+    streams = (SearchAdsStream(stream_name, config=config) for stream_name in AVAILABLE_STREAMS)
     catalog = get_catalog(streams)
     logger.info('Finished discover ..')
     return json.dump(catalog, sys.stdout, indent=2)
 
 def sync(client, config, catalog, state):
     logger.info('Starting Sync..')
-    # request all data first
+    # request all data first, then write each stream when its reports are ready
+    scheduler = ReportScheduler(client, max_workers=int(config.get('max_workers', DEFAULT_MAX_WORKERS)))
+    cache = None
+    if config.get('cache_dir'):
+        cache = ReportCache(config['cache_dir'], ttl=int(config.get('cache_ttl', DEFAULT_TTL)), max_size=int(config.get('cache_max_size', DEFAULT_MAX_SIZE)))
+    # the client records the api calls, the streams their own phases
+    stats = client.stats if client else SyncStats()
+    pool = None
+    if int(config.get('convert_processes', 0)) and config.get('parse_engine', 'csv') == 'csv':
+        # the processes are only started when used
+        from .processes import get_pool
+        pool = get_pool(int(config['convert_processes']))
     for catalog_entry in catalog.get_selected_streams(state):
-        stream = SearchAdsStream(name=catalog_entry.stream, client=client, config=config, catalog_stream=catalog_entry.stream, state=state)
-        stream.write(catalog_entry.metadata)
+        stream = SearchAdsStream(name=catalog_entry.stream, client=client, config=config, catalog_stream=catalog_entry.stream, state=state, cache=cache, stats=stats, pool=pool)
+        scheduler.add(stream, catalog_entry.metadata)
+    try:
+        scheduler.run()
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    stats.log()
+    if config.get('metrics_summary'):
+        stats.write_summary(config['metrics_summary'])
 
     logger.info(f'Finished sync..')
     
+def parse_args():
+    # options of the tap, singer parse_args only knows the standard ones
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--replay', action='store_true', help='Write the records of the cached reports, without any request to the API')
+    parser.add_argument('--profile', metavar='DIR', help='Write a cProfile and tracemalloc report of each stream in this directory')
+    tap_args, sys.argv[1:] = parser.parse_known_args()
+
+    args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
+    if tap_args.replay:
+        if not args.config.get('cache_dir'):
+            raise Exception('--replay needs a cache_dir in the config file')
+        args.config['replay'] = True
+    if tap_args.profile:
+        args.config['profile_dir'] = tap_args.profile
+    return args
+
 @singer.utils.handle_top_exception(logger)
 def main():
-    args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
+    args = parse_args()
     client = GoogleSearchAdsClient(
         args.config['client_id'],
         args.config['client_secret'],
-        args.config['refresh_token']
+        args.config['refresh_token'],
+        polling_options={option: float(args.config[f'polling_{option}']) for option in ('first_delay', 'max_delay', 'timeout') if args.config.get(f'polling_{option}')},
+        pool_size=int(args.config.get('pool_size', max(DEFAULT_POOL_SIZE, int(args.config.get('max_workers', DEFAULT_MAX_WORKERS))))),
+        rate_limiter=RateLimiter(rate=float(args.config.get('requests_per_second', DEFAULT_RATE)), burst=int(args.config.get('requests_burst', DEFAULT_BURST))),
+        token_cache=args.config.get('token_cache')
     )
     
+    if args.config.get('replay') and not args.discover:
+        # offline, the client is not used
+        sync(client=None, config=args.config, catalog=args.catalog, state=args.state)
+        return
+
     with client:
         if args.discover:
             discover(config=args.config)
@@ -0,0 +1,293 @@
+import asyncio
+import csv
+import json
+import time
+import backoff
+import singer
+from .client import (BASE_API_URL, GOOGLE_TOKEN_URI, CHUNK_SIZE, DEFAULT_POOL_SIZE, DOWNLOAD_RETRIES,
+                     ClientHttpError, ClientTooManyRequestError, ClientHttp5xxError, ClientExpiredError, count_retry)
+from .polling import ReportPoller, ReportTimeoutError
+from .stats import SyncStats
+from .ratelimit import RateLimiter
+from .auth import REFRESH_MARGIN
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = singer.get_logger()
+DEFAULT_MAX_CONCURRENCY = 20 # api calls and downloads in flight at the same time
+READ_TIMEOUT = 300 # no total timeout, a large file can take longer to download
+
+
+def check_response(status, resp):
+    """ Raise the same errors as GoogleSearchAdsClient.do_request for a failed call """
+    if status == 429:
+        raise ClientTooManyRequestError('Too many requests, retry ..')
+    elif status == 401:
+        raise ClientExpiredError('Token is expired, retry ..')
+    message = (resp or {}).get('error', {}).get('errors', [{}])[0].get('message', '')
+    raise ClientHttpError(f'{status}: {message}')
+
+
+class AsyncReportReader:
+    """
+        Same as ReportReader in an event loop: async for row in client.extract_data(file_url).
+        Lines are parsed chunk by chunk, a quoted value with new lines is kept with the rest of its row.
+    """
+    def __init__(self, client, file_url, offset=0, retries=DOWNLOAD_RETRIES, stats=None):
+        self.client = client
+        self.file_url = file_url
+        self.offset = offset
+        self.retries = retries
+        self.stats = stats or SyncStats()
+        self.header = None
+        self.download_time = 0.0
+
+    async def download(self):
+        chunks = self.client.download(self.file_url, offset=self.offset).__aiter__()
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                self.download_time += elapsed
+                self.stats.add_time('download', elapsed)
+            self.stats.increment('download_bytes', len(chunk))
+            yield chunk
+
+    async def records(self):
+        """ Yield the complete csv records of each chunk with their size in bytes """
+        retries = 0
+        while True:
+            pending, record, quotes = b'', [], 0
+            try:
+                async for chunk in self.download():
+                    lines = (pending + chunk).split(b'\n')
+                    pending = lines.pop()
+                    records = []
+                    for line in lines:
+                        record.append(line)
+                        quotes += line.count(b'"')
+                        # an odd number of quotes: the new line is in a quoted value
+                        if quotes % 2 == 0:
+                            data = b'\n'.join(record) + b'\n'
+                            records.append((data.decode('utf-8'), len(data)))
+                            record, quotes = [], 0
+                    if records:
+                        yield records
+                break
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                retries += 1
+                self.stats.increment('retry_count', error=type(e).__name__)
+                if retries > self.retries:
+                    raise
+                logger.warning(f'Download interrupted ({e}), resume from byte {self.offset}..')
+        if record or pending:
+            data = b'\n'.join(record + [pending])
+            yield [(data.decode('utf-8'), len(data))]
+
+    async def __aiter__(self):
+        skip_header = self.offset == 0
+        async for records in self.records():
+            for (_, size), row in zip(records, csv.reader([text for text, _ in records])):
+                self.offset += size
+                if skip_header:
+                    self.header, skip_header = row, False
+                    continue
+                yield row
+
+
+class AsyncGoogleSearchAdsClient:
+    """
+        asyncio version of GoogleSearchAdsClient, with the same methods as coroutines: a single event loop
+        drives the reports from their request to the download of their files.
+        At most max_concurrency api calls and downloads are in flight, the others wait for their turn.
+
+        async with AsyncGoogleSearchAdsClient(client_id, client_secret, refresh_token) as client:
+            report_id, files = await client.get_report_files(request_body)
+            async for row in client.extract_data(files[0]['url']):
+                ...
+    """
+    def __init__(self, client_id, client_secret, refresh_token=None, access_token=None, polling_options=None, pool_size=DEFAULT_POOL_SIZE,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, stats=None, rate_limiter=None):
+        if aiohttp is None:
+            raise Exception('The async client needs aiohttp: pip install tap-searchads360[async]')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_token = refresh_token
+        self.access_token = access_token
+        # same as TokenManager: a token given without its expiry is used until it is rejected
+        self.expires = float('inf') if access_token else 0
+        self.pool_size = pool_size
+        self.max_concurrency = max_concurrency
+        # first_delay, max_delay and timeout of ReportPoller
+        self.polling_options = polling_options or {}
+        self.stats = stats or SyncStats()
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.session = None
+        self.semaphore = None
+        self.token_lock = None
+
+    async def __aenter__(self):
+        # created in the running loop
+        connector = aiohttp.TCPConnector(limit_per_host=self.pool_size)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=READ_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers={'Accept-Encoding': 'gzip'})
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.token_lock = asyncio.Lock()
+        if self.refresh_token:
+            await self.get_access_token()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+
+    def is_token_valid(self):
+        return self.access_token is not None and time.time() < self.expires - REFRESH_MARGIN
+
+    def invalidate_token(self, access_token):
+        # the token was rejected, unless another coroutine already refreshed it
+        if access_token == self.access_token:
+            self.access_token, self.expires = None, 0
+
+    @backoff.on_exception(backoff.expo, ClientHttp5xxError, max_tries=3, on_backoff=count_retry)
+    async def get_access_token(self):
+        """ Return a valid access token, refreshed REFRESH_MARGIN seconds before it expires """
+        if self.is_token_valid():
+            return self.access_token
+        # one refresh at a time, the other coroutines get its token
+        async with self.token_lock:
+            if self.is_token_valid():
+                return self.access_token
+
+            payloads = {
+                'grant_type': 'refresh_token',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': self.refresh_token
+            }
+            async with self.session.post(GOOGLE_TOKEN_URI, data=payloads) as response:
+                self.stats.increment('token_refresh_count')
+                # the body of a 5xx is not always json
+                if response.status >= 500:
+                    raise ClientHttp5xxError()
+                resp = await response.json(content_type=None)
+            if response.status == 200:
+                self.access_token, self.expires = resp.get('access_token', ''), time.time() + resp.get('expires_in')
+                logger.info(f"Access token refreshed, expires in {resp.get('expires_in')} sec")
+                return self.access_token
+            message = resp.get('error_description') or resp['error']['errors'][0]['message']
+            raise ClientHttpError(f'Status code {response.status}: {message}')
+
+    @backoff.on_exception(backoff.expo, (ClientTooManyRequestError, ClientExpiredError), max_tries=7, on_backoff=count_retry)
+    async def do_request(self, url, data=None):
+        """ Call the api and return its json response """
+        access_token = await self.get_access_token()
+
+        params = {'access_token': access_token}
+        headers = {'Content-Type': 'application/json'}
+        async with self.semaphore:
+            self.stats.add_time('rate_limit_wait', await self.rate_limiter.acquire_async())
+            method = self.session.post if data else self.session.get
+            async with method(url, params=params, headers=headers, data=data) as response:
+                logger.info(f'request api: {url}, response status: {response.status}')
+                self.stats.increment('http_request_count', status=response.status)
+                resp = await response.json(content_type=None)
+        if response.status in (200, 202):
+            self.rate_limiter.on_success()
+            return resp
+        if response.status == 429:
+            self.rate_limiter.on_throttle()
+        if response.status == 401:
+            self.invalidate_token(access_token)
+        check_response(response.status, resp)
+
+    @backoff.on_exception(backoff.expo, (ClientTooManyRequestError, ClientExpiredError), max_tries=7, on_backoff=count_retry)
+    async def get_file(self, file_url, offset=0):
+        """ Open the download of a file, the response must be released by the caller """
+        access_token = await self.get_access_token()
+
+        headers = {'Authorization': 'Bearer '+access_token}
+        if offset:
+            # offsets are counted on the decoded content, ask for it as is
+            headers.update({'Range': f'bytes={offset}-', 'Accept-Encoding': 'identity'})
+        self.stats.add_time('rate_limit_wait', await self.rate_limiter.acquire_async())
+        response = await self.session.get(file_url, headers=headers)
+        logger.info(f'request api: {file_url}, response status: {response.status}')
+        self.stats.increment('http_request_count', status=response.status)
+        if response.status in (200, 206):
+            self.rate_limiter.on_success()
+            return response
+        if response.status == 429:
+            self.rate_limiter.on_throttle()
+        resp = await response.json(content_type=None) if response.content_type == 'application/json' else None
+        response.release()
+        if response.status == 401:
+            self.invalidate_token(access_token)
+        check_response(response.status, resp)
+
+    async def request_report(self, payloads):
+        with self.stats.timer('request'):
+            resp = await self.do_request(BASE_API_URL, data=json.dumps(payloads))
+        return resp.get('id', '')
+
+    async def process_files(self, report_id):
+        """ Return the report files, or False if the report is not ready yet """
+        with self.stats.timer('poll'):
+            resp = await self.do_request(BASE_API_URL+'/'+report_id)
+        if resp.get('isReportReady', False):
+            return resp.get('files', [])
+        return False
+
+    async def get_files_link(self, report_id):
+        """ Check the report with the delays of ReportPoller until it is ready, without blocking the other reports """
+        poller = ReportPoller(self, **self.polling_options)
+        deadline = time.monotonic() + poller.timeout
+        logger.info(f'Starting polling report {report_id}..')
+        await asyncio.sleep(poller.first_delay)
+        attempts = 0
+        while True:
+            files = await self.process_files(report_id)
+            if files is not False:
+                logger.info(f'finished polling report {report_id}..')
+                return files
+            if time.monotonic() >= deadline:
+                raise ReportTimeoutError(f'Report {report_id} is still not ready after {poller.timeout} sec')
+            attempts += 1
+            await asyncio.sleep(min(poller.next_delay(attempts), max(deadline - time.monotonic(), 0)))
+
+    async def get_report_files(self, request_body=None, saved_report_id=None):
+        if request_body:
+            report_id = await self.request_report(request_body)
+            logger.info(f'Requested report: {report_id}')
+        elif saved_report_id:
+            report_id = saved_report_id
+            logger.info(f'Saved report: {report_id}')
+        else:
+            raise Exception("Can not get files: report_id not found")
+        if report_id:
+            return report_id, await self.get_files_link(report_id)
+
+    async def download(self, file_url, offset=0):
+        """ Yield the file content by chunks from the byte offset """
+        async with self.semaphore:
+            response = await self.get_file(file_url, offset=offset)
+            try:
+                skip = offset if response.status != 206 else 0
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if skip:
+                        # range not supported, drop what was already read
+                        chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+                    if chunk:
+                        yield chunk
+            finally:
+                response.release()
+
+    def extract_data(self, file_url, offset=0, stats=None):
+        # parse the file while downloading it, the whole report is never loaded in memory
+        return AsyncReportReader(self, file_url, offset=offset, stats=stats)
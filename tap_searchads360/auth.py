@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import singer
+
+logger = singer.get_logger()
+REFRESH_MARGIN = 5 * 60 # refresh the access token 5 minutes before it expires
+
+
+class TokenManager:
+    """
+        Access token shared by all the threads of a client, refreshed by a single thread refresh_margin seconds before it expires.
+        With a cache_path, the token and its expiry are kept in this file (readable by its owner only) and reused
+        by the next runs while it is valid, without calling the token uri.
+    """
+    def __init__(self, refresh, cache_path=None, cache_key='', access_token=None, refresh_margin=REFRESH_MARGIN):
+        # refresh() returns a new access token and its lifetime in seconds
+        self.refresh = refresh
+        self.cache_path = cache_path
+        # tokens of other accounts in the same file are not used
+        self.cache_key = hashlib.sha256(cache_key.encode('utf-8')).hexdigest()
+        self.refresh_margin = refresh_margin
+        self.access_token = access_token
+        # a token given without its expiry is used until it is rejected
+        self.expires = float('inf') if access_token else 0
+        self.lock = threading.Lock()
+
+    def is_valid(self):
+        return self.access_token is not None and time.time() < self.expires - self.refresh_margin
+
+    def get(self):
+        # read once without the lock: an invalidate() in another thread can't change the token returned
+        access_token, expires = self.access_token, self.expires
+        if access_token is not None and time.time() < expires - self.refresh_margin:
+            return access_token
+        with self.lock:
+            # another thread may have refreshed it while this one was waiting
+            if not self.is_valid() and not self.load():
+                access_token, expires_in = self.refresh()
+                self.access_token, self.expires = access_token, time.time() + expires_in
+                logger.info(f'Access token refreshed, expires in {expires_in} sec')
+                self.save()
+            return self.access_token
+
+    def invalidate(self, access_token):
+        """ The token was rejected, the next get() refreshes it unless another thread already did """
+        with self.lock:
+            if access_token == self.access_token:
+                self.access_token, self.expires = None, 0
+                self.save()
+
+    def load(self):
+        if not self.cache_path:
+            return False
+        try:
+            with open(self.cache_path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cached.get('key') != self.cache_key or not cached.get('access_token'):
+            return False
+        self.access_token, self.expires = cached['access_token'], cached['expires']
+        if not self.is_valid():
+            return False
+        logger.info(f'Access token loaded from {self.cache_path}')
+        return True
+
+    def save(self):
+        if not self.cache_path:
+            return
+        path = f'{self.cache_path}.{os.getpid()}.tmp'
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': self.cache_key, 'access_token': self.access_token, 'expires': self.expires}, f)
+            os.replace(path, self.cache_path)
+        except OSError as e:
+            # the cache only saves a refresh
+            logger.warning(f'Can not write the token cache {self.cache_path}: {e}')
@@ -0,0 +1,123 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+import singer
+
+logger = singer.get_logger()
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_MAX_SIZE = 10 * 1024 ** 3 # 10GB
+GZIP_LEVEL = 3 # fast enough to keep up with the download
+CHUNK_SIZE = 1024 * 1024
+CACHE_PREFIX = 'cache:'
+
+
+class ReportCache:
+    """
+        Local copy of the downloaded report files, gzip compressed.
+        A report is stored under the sha256 of its canonical request body: the same request gets the same files back
+        until the ttl expires. The least recently used reports are removed when the cache grows over max_size bytes.
+    """
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(request_body):
+        payloads = json.dumps(request_body, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payloads.encode('utf-8')).hexdigest()
+
+    def get_path(self, key, *paths):
+        return os.path.join(self.directory, key, *paths)
+
+    def get_files(self, key, ttl=True):
+        """ Return the cached files of the report, or None if not cached or expired when ttl is checked """
+        meta_path = self.get_path(key, 'meta.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if ttl and time.time() - meta['created'] > self.ttl:
+            logger.info(f'Cached report {key} is expired')
+            return None
+        # last access time, used to evict the least recently used reports
+        os.utime(meta_path)
+        return [{'url': CACHE_PREFIX + self.get_path(key, f'{index}.csv.gz')} for index in range(meta['file_count'])]
+
+    def download(self, file_url, offset=0):
+        """ Same as GoogleSearchAdsClient.download for a cached file """
+        with gzip.open(file_url[len(CACHE_PREFIX):], 'rb') as f:
+            f.seek(offset)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                yield chunk
+
+    def writer(self, key, file_count):
+        return ReportCacheWriter(self, key, file_count)
+
+    def evict(self):
+        reports = []
+        for key in os.listdir(self.directory):
+            path = self.get_path(key)
+            if not os.path.isdir(path):
+                continue
+            try:
+                last_access = os.path.getmtime(os.path.join(path, 'meta.json'))
+            except OSError:
+                # unfinished report
+                last_access = os.path.getmtime(path)
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            reports.append((last_access, size, path))
+        total_size = sum(size for _, size, _ in reports)
+        for _, size, path in sorted(reports):
+            if total_size <= self.max_size:
+                break
+            logger.info(f'Remove {path} from cache')
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+
+
+class ReportCacheWriter:
+    """
+        Copy the report files in the cache while they are downloaded, the report is only available once every file is complete.
+        tee() is used as the download source of a ReportReader.
+    """
+    def __init__(self, cache, key, file_count):
+        self.cache = cache
+        self.key = key
+        self.file_count = file_count
+        self.path = cache.get_path(key + '.tmp')
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+
+    def tee(self, source, index):
+        return ReportFileCopy(source, os.path.join(self.path, f'{index}.csv.gz'))
+
+    def commit(self):
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'created': time.time(), 'file_count': self.file_count}, f)
+        path = self.cache.get_path(self.key)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(self.path, path)
+        self.cache.evict()
+
+
+class ReportFileCopy:
+    def __init__(self, source, path):
+        self.source = source
+        self.path = path
+        self.written = 0
+
+    def download(self, file_url, offset=0):
+        # a resumed download sends again the bytes after offset, only write the new ones
+        with gzip.open(self.path, 'ab', compresslevel=GZIP_LEVEL) as f:
+            for chunk in self.source.download(file_url, offset=offset):
+                position, offset = offset, offset + len(chunk)
+                if offset > self.written:
+                    f.write(chunk[max(self.written - position, 0):])
+                    self.written = offset
+                yield chunk
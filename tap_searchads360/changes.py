@@ -0,0 +1,91 @@
+import hashlib
+import os
+import numpy
+import singer
+from .stats import SyncStats
+
+logger = singer.get_logger()
+DEFAULT_MAX_ROWS = 1000000 # rows kept per stream and advertiser
+DIGEST_SIZE = 8
+MERGE_ROWS = 100000 # rows written since the last merge, kept in a dict until then
+ENTRY = numpy.dtype([('key', '<u8'), ('content', '<u8'), ('seen', '<u4')])
+
+
+def get_digest(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=DIGEST_SIZE).digest(), 'little')
+
+
+class ChangeIndex:
+    """
+        Latest content of the rows written for a stream and an advertiser, kept in a file between runs.
+        A row is identified by the digest of its key properties and segment columns, its content by the digest of its json:
+        a row is written when it is new or its content differs from the last one written, an unchanged row
+        (e.g. the days read again with offset_start_date) is suppressed.
+        The rows are kept in sorted arrays, 20 bytes per row, at most max_rows: the rows not seen for the most syncs are dropped first.
+        Saved once a report is complete: after a failed sync the rows are written again rather than lost.
+    """
+    def __init__(self, path, max_rows=DEFAULT_MAX_ROWS, stats=None):
+        self.path = path
+        self.max_rows = max_rows
+        self.stats = stats or SyncStats()
+        entries = self.load()
+        self.keys, self.contents, self.seen = entries['key'].copy(), entries['content'].copy(), entries['seen'].copy()
+        # number of the current sync, the rows it sees are kept first
+        self.generation = int(self.seen.max()) + 1 if len(self.seen) else 1
+        # rows written since the last merge: key digest -> content digest
+        self.written = {}
+        self.suppressed = 0
+
+    def load(self):
+        try:
+            return numpy.fromfile(self.path, dtype=ENTRY)
+        except FileNotFoundError:
+            return numpy.empty(0, dtype=ENTRY)
+
+    def is_new(self, identity, record):
+        """ Check a record encoded in json and remember it, identity is the json of its key columns (the record itself if None) """
+        key, content = get_digest(identity if identity is not None else record), get_digest(record)
+        last = self.written.get(key)
+        if last is None and len(self.keys):
+            position = int(self.keys.searchsorted(numpy.uint64(key)))
+            if position < len(self.keys) and int(self.keys[position]) == key:
+                self.seen[position] = self.generation
+                last = int(self.contents[position])
+        if last == content:
+            self.suppressed += 1
+            return False
+        self.written[key] = content
+        if len(self.written) >= MERGE_ROWS:
+            self.merge()
+        return True
+
+    def filter(self, records, identities=None):
+        if identities is None:
+            return [record for record in records if self.is_new(None, record)]
+        return [record for record, identity in zip(records, identities) if self.is_new(identity, record)]
+
+    def merge(self):
+        """ Move the rows written to the sorted arrays, keep the max_rows seen by the latest syncs """
+        keys = numpy.fromiter(self.written.keys(), dtype='<u8', count=len(self.written))
+        contents = numpy.fromiter(self.written.values(), dtype='<u8', count=len(self.written))
+        kept = ~numpy.isin(self.keys, keys)
+        keys = numpy.concatenate((self.keys[kept], keys))
+        contents = numpy.concatenate((self.contents[kept], contents))
+        seen = numpy.concatenate((self.seen[kept], numpy.full(len(self.written), self.generation, dtype='<u4')))
+        if len(keys) > self.max_rows:
+            recent = numpy.argsort(seen, kind='stable')[-self.max_rows:]
+            keys, contents, seen = keys[recent], contents[recent], seen[recent]
+        order = numpy.argsort(keys)
+        self.keys, self.contents, self.seen = keys[order], contents[order], seen[order]
+        self.written = {}
+
+    def save(self):
+        self.merge()
+        self.stats.increment('suppressed_rows', self.suppressed)
+        logger.info(f'{self.suppressed} unchanged rows not written, {len(self.keys)} rows in {self.path}')
+        self.suppressed = 0
+        entries = numpy.empty(len(self.keys), dtype=ENTRY)
+        entries['key'], entries['content'], entries['seen'] = self.keys, self.contents, self.seen
+        path = f'{self.path}.{os.getpid()}.tmp'
+        entries.tofile(path)
+        os.replace(path, self.path)
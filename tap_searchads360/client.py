@@ -1,17 +1,27 @@
 import singer
+import sys
 import requests
-import time
 import tempfile
 import csv
 import json
 import backoff
-import io
-from datetime import datetime, timedelta
+import time
+from requests.adapters import HTTPAdapter
+from .polling import ReportPoller
+from .stats import SyncStats
+from .ratelimit import RateLimiter
+from .auth import TokenManager
+from .files import prefetch
 
 logger = singer.get_logger()
 BASE_API_URL = 'https://www.googleapis.com/doubleclicksearch/v2/reports'
 GOOGLE_TOKEN_URI = 'https://accounts.google.com/o/oauth2/token'
-POLLING_TIME = 60 # 1 minute is the recommandation
+CHUNK_SIZE = 1024 * 1024 # download report files by 1MB chunks
+DEFAULT_POOL_SIZE = 10 # connections kept alive per host, should be at least the number of workers
+POOL_HOSTS = 4 # api, oauth and file download hosts
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_ERRORS = (requests.exceptions.ChunkedEncodingError, requests.exceptions.ConnectionError)
+DOWNLOAD_QUEUE = 8 # chunks downloaded ahead of the parsing, per file
 
 class ClientHttpError(Exception):
     pass
@@ -25,19 +35,135 @@ class ClientHttp5xxError(Exception):
 class ClientExpiredError(Exception):
     pass
 
+def count_retry(details):
+    # backoff handler, the client is the first argument of the retried method
+    # older backoff versions don't pass the exception, the handler is called while it is handled
+    exception = details.get('exception') or sys.exc_info()[1]
+    details['args'][0].stats.increment('retry_count', error=type(exception).__name__)
+
+class ReportReader:
+    """
+        Csv rows of a report file, parsed while downloading. The header is skipped when reading from the start.
+        offset is the byte position right after the last row read: an interrupted download resumes there with a Range request.
+        The file is downloaded by a thread of its own, up to DOWNLOAD_QUEUE chunks ahead: download_time is the time spent waiting for it.
+    """
+    def __init__(self, client, file_url, offset=0, retries=DOWNLOAD_RETRIES, stats=None):
+        self.client = client
+        self.file_url = file_url
+        self.offset = offset
+        self.retries = retries
+        self.stats = stats or SyncStats()
+        self.header = None
+        self.download_time = 0.0
+
+    def lines(self):
+        # utf-8 multi-bytes characters never contain b'\n', so each line can be decoded on its own
+        retries = 0
+        while True:
+            pending = b''
+            try:
+                for chunk in self.download():
+                    lines = (pending + chunk).split(b'\n')
+                    pending = lines.pop()
+                    for line in lines:
+                        self.offset += len(line) + 1
+                        yield line.decode('utf-8') + '\n'
+                break
+            except DOWNLOAD_ERRORS as e:
+                retries += 1
+                self.stats.increment('retry_count', error=type(e).__name__)
+                if retries > self.retries:
+                    raise
+                logger.warning(f'Download interrupted ({e}), resume from byte {self.offset}..')
+        if pending:
+            self.offset += len(pending)
+            yield pending.decode('utf-8')
+
+    def blocks(self, size=CHUNK_SIZE):
+        """
+            Same as lines() by blocks of whole csv rows of at least size bytes, not decoded.
+            A quoted value with new lines is kept with the rest of its row. The header is skipped when reading from the start.
+        """
+        retries = 0
+        skip_header = self.offset == 0
+        while True:
+            pending = b''
+            try:
+                for chunk in self.download():
+                    pending += chunk
+                    if skip_header and b'\n' in pending:
+                        end = pending.index(b'\n') + 1
+                        self.header = next(csv.reader([pending[:end].decode('utf-8')]), None)
+                        self.offset, pending, skip_header = self.offset + end, pending[end:], False
+                    if len(pending) < size:
+                        continue
+                    end = pending.rfind(b'\n') + 1
+                    # an odd number of quotes: the last new line is in a quoted value, wait for the end of the row
+                    if end and pending.count(b'"', 0, end) % 2 == 0:
+                        self.offset += end
+                        yield pending[:end]
+                        pending = pending[end:]
+                break
+            except DOWNLOAD_ERRORS as e:
+                retries += 1
+                self.stats.increment('retry_count', error=type(e).__name__)
+                if retries > self.retries:
+                    raise
+                logger.warning(f'Download interrupted ({e}), resume from byte {self.offset}..')
+        if pending and skip_header:
+            self.header = next(csv.reader([pending.decode('utf-8')]), None)
+            self.offset += len(pending)
+        elif pending:
+            self.offset += len(pending)
+            yield pending
+
+    def fetch(self):
+        """ Chunks of the file from offset, in the download thread """
+        chunks = iter(self.client.download(self.file_url, offset=self.offset))
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            self.stats.add_time('download', time.perf_counter() - start)
+            if chunk is None:
+                return
+            self.stats.increment('download_bytes', len(chunk))
+            yield chunk
+
+    def download(self):
+        chunks = prefetch(self.fetch(), 'download', DOWNLOAD_QUEUE, self.stats)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            self.download_time += time.perf_counter() - start
+            if chunk is None:
+                return
+            yield chunk
+
+    def __iter__(self):
+        rows = csv.reader(self.lines())
+        if self.offset == 0:
+            self.header = next(rows, None)
+        return rows
+
 class GoogleSearchAdsClient:
     """
         Handle google oauth2 and requests from google search ads 360 API
         Requests method API used:
         'requests' and 'get' in the Reports section: https://developers.google.com/search-ads/v2/reference/reports
     """
-    def __init__(self, client_id, client_secret, refresh_token=None, access_token=None):
+    def __init__(self, client_id, client_secret, refresh_token=None, access_token=None, polling_options=None, pool_size=DEFAULT_POOL_SIZE, stats=None, rate_limiter=None,
+                 token_cache=None):
         self.client_id = client_id
         self.client_secret = client_secret
         self.refresh_token = refresh_token
-        self.access_token = access_token
-        self.expires = None
-        self.session = requests.Session()
+        # shared by the threads, refreshed before it expires and optionally kept in the token_cache file between runs
+        self.tokens = TokenManager(self.refresh_access_token, cache_path=token_cache, cache_key=f'{client_id}:{refresh_token}', access_token=access_token)
+        self.session = self.get_session(pool_size)
+        # first_delay, max_delay and timeout of ReportPoller
+        self.polling_options = polling_options or {}
+        self.stats = stats or SyncStats()
+        # every request waits for its turn, whatever the thread
+        self.rate_limiter = rate_limiter or RateLimiter()
 
     def __enter__(self):
         if self.refresh_token:
@@ -45,82 +171,113 @@ class GoogleSearchAdsClient:
         return self
     
     def __exit__(self, *args):
+        logger.info(f'HTTP connections: {self.connection_stats()}')
         self.session.close()
 
-    @backoff.on_exception(backoff.expo, ClientHttp5xxError, max_tries=3)
+    def get_session(self, pool_size):
+        """ All the requests share keep-alive connections, pool_size connections per host """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size, pool_block=True)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+        return session
+
+    def connection_stats(self):
+        """ Count the requests sent and the connections opened by the session, every other request reused a connection """
+        stats = {'requests': 0, 'connections': 0}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    stats['requests'] += pool.num_requests
+                    stats['connections'] += pool.num_connections
+        stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+        return stats
+
+    @property
+    def access_token(self):
+        return self.tokens.access_token
+
     def get_access_token(self):
-        if self.access_token is not None and self.expires > datetime.utcnow():
-            return
+        return self.tokens.get()
 
+    @backoff.on_exception(backoff.expo, ClientHttp5xxError, max_tries=3, on_backoff=count_retry)
+    def refresh_access_token(self):
+        """ Ask a new access token, return it with its lifetime in seconds """
         payloads = {
             'grant_type': 'refresh_token',
             'client_id': self.client_id,
             'client_secret': self.client_secret,
             'refresh_token': self.refresh_token
         }
-        response = requests.post(url=GOOGLE_TOKEN_URI, data=payloads)
-        resp = response.json()
+        response = self.session.post(url=GOOGLE_TOKEN_URI, data=payloads)
+        self.stats.increment('token_refresh_count')
         if response.status_code == 200:
-            self.access_token = resp.get('access_token', '')
-            self.expires = datetime.utcnow() + timedelta(seconds=resp.get('expires_in'))
-        elif response.status_code <= 500:
+            resp = response.json()
+            return resp.get('access_token', ''), resp.get('expires_in')
+        elif response.status_code >= 500:
             raise ClientHttp5xxError()
         else:
-            message = resp['error']['errors'][0]['message']
+            resp = response.json()
+            message = resp.get('error_description') or resp['error']['errors'][0]['message']
             raise ClientHttpError(f'Status code {response.status_code}: {message}')
-        
-    @backoff.on_exception(backoff.expo, (ClientTooManyRequestError, ClientExpiredError), max_tries=7)
+
+    @backoff.on_exception(backoff.expo, (ClientTooManyRequestError, ClientExpiredError), max_tries=7, on_backoff=count_retry)
     def do_request(self, url, **kwargs):
-        self.get_access_token()
+        access_token = self.get_access_token()
 
-        req = requests.get
+        req = self.session.get
         if kwargs.get('data', None):
-            req = requests.post
-        if not kwargs.get('headers', None):
-            kwargs['params'] = {"access_token": self.access_token}
+            req = self.session.post
+        if kwargs.get('headers', None) is None:
+            kwargs['params'] = {"access_token": access_token}
             kwargs['headers'] = {"Content-Type": "application/json"}
-        
+        else:
+            # files are downloaded with the token in the header
+            kwargs['headers'] = {**kwargs['headers'], 'Authorization': 'Bearer '+access_token}
+
+        self.stats.add_time('rate_limit_wait', self.rate_limiter.acquire())
         response = req(url=url, **kwargs)
         logger.info(f'request api: {url}, response status: {response.status_code}')
-        if response.status_code == 200 or response.status_code == 202:
+        self.stats.increment('http_request_count', status=response.status_code)
+        if response.status_code in (200, 202, 206):
+            self.rate_limiter.on_success()
             return response
 
         #handle error
         error_response = response.json()
         if response.status_code == 429:
+            self.rate_limiter.on_throttle()
             raise ClientTooManyRequestError(f'Too many requests, retry ..')
         elif response.status_code == 401:
+            self.tokens.invalidate(access_token)
             raise ClientExpiredError(f'Token is expired, retry ..')
         else:
             message = error_response['error']['errors'][0]['message']
             raise ClientHttpError(f'{response.status_code}: {message}')
 
     def request_report(self, payloads):
-        response = self.do_request(BASE_API_URL, data=json.dumps(payloads))
+        with self.stats.timer('request'):
+            response = self.do_request(BASE_API_URL, data=json.dumps(payloads))
         resp = response.json()
         return resp.get('id', '')
 
     def process_files(self, report_id):
-        response = self.do_request(BASE_API_URL+'/'+report_id)
+        """ Return the report files, or False if the report is not ready yet """
+        with self.stats.timer('poll'):
+            response = self.do_request(BASE_API_URL+'/'+report_id)
         resp = response.json()
         if resp.get('isReportReady', False):
             return resp.get('files', [])
         return False
 
+    def get_poller(self, max_workers=1):
+        return ReportPoller(self, max_workers=max_workers, **self.polling_options)
 
     def get_files_link(self, report_id):
-        ready = False
-        files = []
-        logger.info('Starting polling..')
-        while not ready:
-            if self.process_files(report_id):
-                files = self.process_files(report_id)
-                ready = True
-            else:
-                logger.info(f'Report is not ready yet, next request in {POLLING_TIME} sec..')
-                time.sleep(POLLING_TIME)
-        logger.info('finished polling..')
-        return files
+        return self.get_poller().wait(report_id)
 
     def get_report_files(self, request_body=None, saved_report_id=None):
         if request_body:
@@ -134,8 +291,22 @@ class GoogleSearchAdsClient:
         if report_id:
             return report_id, self.get_files_link(report_id)
             
-    def extract_data(self, file_url):
-        # To download file we have to set the token on the header
-        headers = {'Authorization': 'Bearer '+self.access_token}
+    def download(self, file_url, offset=0):
+        """ Yield the file content by chunks from the byte offset """
+        # To download file we have to set the token on the header, do_request adds it
+        headers = {}
+        if offset:
+            # offsets are counted on the decoded content, ask for it as is
+            headers.update({'Range': f'bytes={offset}-', 'Accept-Encoding': 'identity'})
         response = self.do_request(file_url, headers=headers, stream=True)
-        return csv.reader(io.StringIO(response.content.decode('utf-8')))
+        skip = offset if response.status_code != 206 else 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if skip:
+                # range not supported, drop what was already read
+                chunk, skip = chunk[skip:], max(skip - len(chunk), 0)
+            if chunk:
+                yield chunk
+
+    def extract_data(self, file_url, offset=0, stats=None):
+        # parse the file while downloading it, the whole report is never loaded in memory
+        return ReportReader(self, file_url, offset=offset, stats=stats)
@@ -0,0 +1,151 @@
+import itertools
+import queue
+import threading
+import time
+import singer
+from concurrent.futures import ThreadPoolExecutor
+from .stats import SyncStats
+
+logger = singer.get_logger()
+DEFAULT_FILE_WORKERS = 4
+BATCH_ROWS = 1000
+QUEUE_BATCHES = 10 # batches parsed ahead per file
+QUEUE_TIMEOUT = 1
+
+_DONE = object()
+
+
+class StageQueue:
+    """
+        Bounded queue between two stages of the pipeline: download -> parse -> emit -> stdout.
+        A full queue blocks the stage before it, so the memory stays bounded whatever the slowest stage is.
+        Records its depth after each put, and the time waited because it was full (the next stage is the bottleneck)
+        or empty (the previous stage is), tagged with its name.
+    """
+    def __init__(self, name, maxsize, stats=None, cancelled=None):
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.stats = stats or SyncStats()
+        # the consumer is gone, put() drops the items instead of waiting
+        self.cancelled = cancelled or threading.Event()
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            start = time.perf_counter()
+            while not self.cancelled.is_set():
+                try:
+                    self.queue.put(item, timeout=QUEUE_TIMEOUT)
+                    break
+                except queue.Full:
+                    continue
+            self.stats.add_time('queue_full', time.perf_counter() - start, queue=self.name)
+        self.stats.observe('queue_depth', self.queue.qsize(), queue=self.name)
+
+    def get(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            with self.stats.timer('queue_empty', queue=self.name):
+                return self.queue.get()
+
+
+def prefetch(items, name, size, stats=None):
+    """ Iterate items in a thread of its own, up to size items ahead of the caller. Its exceptions are raised to the caller """
+    cancelled = threading.Event()
+    buffer = StageQueue(name, size, stats, cancelled)
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+                if cancelled.is_set():
+                    return
+            buffer.put(_DONE)
+        except Exception as e:
+            buffer.put(e)
+        finally:
+            if hasattr(items, 'close'):
+                items.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+
+
+def read_batches(reader, batch_rows=BATCH_ROWS):
+    """
+        Yield the rows of a ReportReader by batches, with the file offset at the end of each batch.
+        The time to read a batch, minus the time spent waiting for the download, is the csv parse time.
+    """
+    rows = iter(reader)
+    while True:
+        start, download_time = time.perf_counter(), reader.download_time
+        batch = list(itertools.islice(rows, batch_rows))
+        reader.stats.add_time('parse', time.perf_counter() - start - (reader.download_time - download_time))
+        if not batch:
+            return
+        yield batch, reader.offset
+
+
+class FilesReader:
+    """
+        Download and parse the files of a report in parallel, max_workers files at a time, while the batches are written.
+        Batches are returned file after file in the report order: each file has its own bounded queue
+        so the files read ahead wait for the current one instead of filling the memory.
+        With a single worker, the next file is read as soon as the current one is parsed.
+    """
+    def __init__(self, readers, max_workers=DEFAULT_FILE_WORKERS, queue_size=QUEUE_BATCHES, read=read_batches):
+        self.readers = readers
+        # read_batches, or frames.read_frames for the pandas engine
+        self.read_batches = read
+        self.max_workers = max_workers
+        self.queue_size = queue_size
+        self.cancelled = threading.Event()
+
+    def read(self, reader, batches):
+        # the files after a failure are not downloaded
+        if self.cancelled.is_set():
+            return
+        try:
+            for batch in self.read_batches(reader):
+                batches.put(batch)
+                if self.cancelled.is_set():
+                    return
+            batches.put(_DONE)
+        except Exception as e:
+            batches.put(e)
+
+    def get(self, batches):
+        while True:
+            item = batches.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def __iter__(self):
+        """ Yield (index, batches) for each file, batches must be consumed before the next file """
+        executor = ThreadPoolExecutor(max_workers=max(self.max_workers, 1))
+        try:
+            pending = []
+            for index, reader in self.readers:
+                batches = StageQueue('parse', self.queue_size, reader.stats, self.cancelled)
+                pending.append((index, batches))
+                executor.submit(self.read, reader, batches)
+            for index, batches in pending:
+                yield index, self.get(batches)
+        finally:
+            self.cancelled.set()
+            # the reads not started yet are dropped, the running ones stop at their next batch
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,124 @@
+import csv
+import io
+import itertools
+import time
+import numpy
+import pandas
+from json.encoder import encode_basestring_ascii as encode_string
+from .writer import encoder
+
+NUMBER_DTYPES = {int: 'Int64', float: 'float64'}
+
+FRAME_ROWS = 10000 # rows parsed by each read_csv call
+
+
+def read_frames(reader, batch_rows=FRAME_ROWS, dtypes=None):
+    """
+        Same as files.read_batches with the pandas engine: each batch of lines is parsed by read_csv in a DataFrame,
+        with the file offset at the end of the batch. Memory is bounded by batch_rows whatever the size of the file.
+        The columns of dtypes (index: dtype) are parsed as numbers, empty values are missing values. The other columns
+        are strings, and all of them when a value of a number column is not a number.
+    """
+    lines = reader.lines()
+    if reader.offset == 0:
+        reader.header = next(csv.reader([next(lines, '')]), None)
+    dtypes = dtypes or {}
+    while True:
+        start, download_time = time.perf_counter(), reader.download_time
+        batch = list(itertools.islice(lines, batch_rows))
+        # an odd number of quotes: the last row has new lines in a quoted value
+        quotes = sum(line.count('"') for line in batch)
+        while quotes % 2:
+            line = next(lines, None)
+            if line is None:
+                break
+            batch.append(line)
+            quotes += line.count('"')
+        if not batch:
+            reader.stats.add_time('parse', time.perf_counter() - start - (reader.download_time - download_time))
+            return
+        text = ''.join(batch)
+        try:
+            # strings as python objects, empty numbers as missing values
+            columns = range(len(next(csv.reader(batch[:1]))))
+            frame = pandas.read_csv(io.StringIO(text), header=None, dtype={index: dtypes.get(index, object) for index in columns}, keep_default_na=False,
+                                    na_values={index: [''] for index in dtypes if index in columns}, float_precision='round_trip')
+        except (TypeError, ValueError, OverflowError):
+            frame = pandas.read_csv(io.StringIO(text), header=None, dtype=object, keep_default_na=False, na_filter=False)
+        reader.stats.add_time('parse', time.perf_counter() - start - (reader.download_time - download_time))
+        yield frame, reader.offset
+
+
+class FrameConverter:
+    """
+        Same conversion as RecordConverter on a DataFrame, column by column, straight to the json of the records:
+        numbers are parsed by read_csv, each column is encoded by a single loop with its cast resolved once,
+        dates once per distinct value, empty values are null. A column of strings that can't be cast as a whole falls back
+        to the cast of RecordConverter, value by value. The json values of a row are joined with the keys of the record:
+        serialize() returns the same text as RecordWriter would write for the records of RecordConverter.
+    """
+    def __init__(self, converter):
+        self.converter = converter
+        self.columns = converter.columns
+        self.encoders = tuple(self.get_encoder(cast) for cast in converter.casts)
+        self.keys = tuple(('{' if index == 0 else ', ') + encode_string(column) + ': ' for index, column in enumerate(self.columns))
+        # columns parsed as numbers by read_csv
+        self.dtypes = {index: NUMBER_DTYPES[cast.type] for index, cast in enumerate(converter.casts) if getattr(cast, 'type', None) in NUMBER_DTYPES}
+
+    def get_encoder(self, cast):
+        if cast == self.converter.convert_date:
+            return self.encode_dates
+        type = getattr(cast, 'type', None)
+        if type in NUMBER_DTYPES:
+            return lambda values: self.encode_numbers(values, cast, type)
+        if type is bool:
+            # same as bool(value): any non empty value is True
+            return lambda values: ['true' if value else 'null' for value in values.tolist()]
+        if cast is str:
+            return lambda values: [encode_string(value) if value else 'null' for value in values.tolist()]
+        return lambda values: self.encode_values(values.tolist(), cast)
+
+    def encode_values(self, values, cast):
+        return [encoder.encode(cast(value)) if value else 'null' for value in values]
+
+    def encode_dates(self, values):
+        values = values.tolist()
+        # converted once per distinct value of the batch
+        dates = {value: encoder.encode(self.converter.convert_date(value)) if value else 'null' for value in set(values)}
+        return list(map(dates.__getitem__, values))
+
+    def encode_numbers(self, values, cast, type):
+        if values.dtype == object:
+            # not parsed by read_csv, some values are not numbers
+            return self.encode_values(values.tolist(), cast)
+        missing = values.isna().to_numpy()
+        if type is int:
+            encoded = list(map(int.__repr__, values.fillna(0).astype('int64').tolist()))
+        else:
+            numbers = values.to_numpy()
+            if numpy.isinf(numbers).any():
+                raise ValueError('Out of range float values are not JSON compliant')
+            encoded = list(map(float.__repr__, numbers.tolist()))
+        for index in numpy.flatnonzero(missing).tolist():
+            encoded[index] = 'null'
+        return encoded
+
+    def serialize_columns(self, frame, columns):
+        """ json arrays of the values of these columns, row by row: the same text as the json of their list """
+        rows = len(frame)
+        values = [self.encoders[index](frame[index]) if index < frame.shape[1] else ['null'] * rows
+                  for index in (self.columns.index(column) for column in columns)]
+        return ['[' + ', '.join(row) + ']' for row in zip(*values)]
+
+    def serialize(self, frame):
+        """ Return the json of the records of the frame """
+        size, rows = min(frame.shape[1], len(self.columns)), len(frame)
+        if not size:
+            return ['{}'] * rows
+        # key, value, key, value.. of every row, joined row by row
+        parts = []
+        for index, key, encode in zip(range(size), self.keys, self.encoders):
+            parts.append([key] * rows)
+            parts.append(encode(frame[index]))
+        parts.append(['}'] * rows)
+        return [''.join(row) for row in zip(*parts)]
@@ -0,0 +1,79 @@
+import random
+import time
+import singer
+from concurrent.futures import ThreadPoolExecutor
+
+logger = singer.get_logger()
+POLLING_FIRST_DELAY = 5 # small reports are often ready within seconds
+POLLING_MAX_DELAY = 120
+POLLING_TIMEOUT = 6 * 60 * 60
+
+
+class ReportTimeoutError(Exception):
+    pass
+
+
+class ReportPoller:
+    """
+        Wait for many reports in a single loop.
+        Each report is first checked a few seconds after its request, then with a jittered exponential backoff
+        capped to max_delay. A report not ready after timeout seconds raises ReportTimeoutError.
+    """
+    def __init__(self, client, first_delay=POLLING_FIRST_DELAY, max_delay=POLLING_MAX_DELAY, timeout=POLLING_TIMEOUT, max_workers=1):
+        self.client = client
+        self.first_delay = first_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.pending = {}
+        self.files = {}
+
+    def add(self, report_id):
+        if report_id in self.pending or report_id in self.files:
+            return
+        now = time.monotonic()
+        self.pending[report_id] = {'attempts': 0, 'next_check': now + self.first_delay, 'deadline': now + self.timeout}
+
+    def next_delay(self, attempts):
+        delay = min(self.max_delay, self.first_delay * 2 ** attempts)
+        return random.uniform(delay / 2, delay)
+
+    def check(self, report_ids):
+        if self.max_workers > 1 and len(report_ids) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(report_ids))) as executor:
+                return list(executor.map(self.client.process_files, report_ids))
+        return [self.client.process_files(report_id) for report_id in report_ids]
+
+    def poll(self):
+        """ Check every report due now and return the ids of the reports that became ready """
+        now = time.monotonic()
+        due = [report_id for report_id, polling in self.pending.items() if polling['next_check'] <= now]
+        ready = []
+        for report_id, files in zip(due, self.check(due)):
+            polling = self.pending[report_id]
+            if files is not False:
+                self.files[report_id] = files
+                del self.pending[report_id]
+                ready.append(report_id)
+                continue
+            now = time.monotonic()
+            if now >= polling['deadline']:
+                raise ReportTimeoutError(f'Report {report_id} is still not ready after {self.timeout} sec')
+            polling['attempts'] += 1
+            polling['next_check'] = min(now + self.next_delay(polling['attempts']), polling['deadline'])
+        return ready
+
+    def wait(self, report_id):
+        """ Poll all the pending reports until report_id is ready and return its files """
+        self.add(report_id)
+        logger.info(f'Starting polling report {report_id}..')
+        while report_id not in self.files:
+            self.poll()
+            if report_id in self.files:
+                break
+            next_check = min(polling['next_check'] for polling in self.pending.values())
+            delay = max(0, next_check - time.monotonic())
+            logger.info(f'Report {report_id} is not ready yet, next check in {delay:.0f} sec..')
+            time.sleep(delay)
+        logger.info(f'finished polling report {report_id}..')
+        return self.files.pop(report_id)
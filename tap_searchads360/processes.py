@@ -0,0 +1,80 @@
+import collections
+import csv
+import functools
+import io
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .streams import RecordConverter, get_schema
+from .writer import encoder
+
+BLOCK_BYTES = 1024 * 1024 # csv rows sent to a process at once
+
+
+def get_pool(processes):
+    """ Processes converting the report files, shared by all the streams of a sync """
+    # spawned: a forked process could inherit a lock held by one of the download threads
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+class RecordBatch:
+    """ Records of a block converted by a process, in the order of the file, with their replication dates, advertisers and identities """
+    def __init__(self, records, dates, advertisers, identities, seconds):
+        self.records = records
+        self.dates = dates
+        self.advertisers = advertisers
+        # json of the key and segment columns, for the change index
+        self.identities = identities
+        # conversion time in the process
+        self.seconds = seconds
+
+    def __len__(self):
+        return len(self.records)
+
+
+@functools.lru_cache(maxsize=None)
+def get_converter(name, columns):
+    # built once per stream in each process
+    return RecordConverter(get_schema(name), columns)
+
+
+def convert_block(name, columns, replication_key, advertiser_column, identity_columns, block):
+    """ Parse and convert the csv rows of a block in a process, return their json as RecordWriter writes it """
+    start = time.process_time()
+    converter = get_converter(name, columns)
+    records, dates, advertisers, identities = [], [], [], []
+    for line in csv.reader(io.StringIO(block.decode('utf-8'))):
+        record = converter(line)
+        records.append(encoder.encode(record))
+        dates.append(record.get(replication_key, ''))
+        if advertiser_column is not None:
+            advertisers.append(line[advertiser_column])
+        if identity_columns:
+            identities.append(encoder.encode([record.get(column) for column in identity_columns]))
+    return RecordBatch(records, dates, advertisers, identities, time.process_time() - start)
+
+
+def read_converted(reader, pool, task, ahead):
+    """
+        Same as files.read_batches with the records converted by the processes of pool: the blocks of the file are
+        converted ahead blocks at a time and returned in order, each one with the file offset at its end.
+        task is the (stream name, columns, replication key, advertiser column, identity columns) of convert_block.
+    """
+    pending = collections.deque()
+    blocks = reader.blocks(BLOCK_BYTES)
+    try:
+        while True:
+            start, download_time = time.perf_counter(), reader.download_time
+            block = next(blocks, None)
+            # splitting the blocks is the only parsing left in this process
+            reader.stats.add_time('parse', time.perf_counter() - start - (reader.download_time - download_time))
+            if block is not None:
+                pending.append((pool.submit(convert_block, *task, block), reader.offset))
+            if pending and (len(pending) >= ahead or block is None):
+                future, offset = pending.popleft()
+                yield future.result(), offset
+            elif block is None:
+                return
+    finally:
+        for future, _ in pending:
+            future.cancel()
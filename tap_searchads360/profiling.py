@@ -0,0 +1,113 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import singer
+
+logger = singer.get_logger()
+TOP_ENTRIES = 30 # functions and allocation sites in the reports
+TRACE_FRAMES = 5 # frames kept per allocation
+SAMPLE_INTERVAL = 5 # seconds between two tracemalloc snapshots
+
+
+class Profiler:
+    """
+        cProfile and tracemalloc of the sync of a stream, in every thread started during the sync (download, parse, emit).
+        Written to directory when done:
+        - <stream>.prof: the cProfile stats, for pstats, snakeviz..
+        - <stream>.profile.txt: the top functions by cumulative and own time
+        - <stream>.allocations.txt: the peak traced memory and the top allocation sites of the largest snapshot,
+          snapshots are taken every SAMPLE_INTERVAL seconds
+    """
+    def __init__(self, directory, name, top=TOP_ENTRIES, interval=SAMPLE_INTERVAL):
+        self.directory = directory
+        self.name = name
+        self.top = top
+        self.interval = interval
+        self.profiles = []
+        self.snapshot = None
+        self.snapshot_size = -1
+        self.snapshot_time = 0
+        self.start = 0
+        self.done = threading.Event()
+        self.sampler = None
+
+    def profile_thread(self, *args):
+        # first event of a new thread, replaced by its own profiler
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # python 3.12+, the profiler of the sync thread already sees every thread
+            sys.setprofile(None)
+            return
+        self.profiles.append(profile)
+
+    def take_snapshot(self):
+        size, _ = tracemalloc.get_traced_memory()
+        if size > self.snapshot_size:
+            self.snapshot, self.snapshot_size, self.snapshot_time = tracemalloc.take_snapshot(), size, time.perf_counter() - self.start
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.take_snapshot()
+
+    def __enter__(self):
+        os.makedirs(self.directory, exist_ok=True)
+        logger.info(f'Profiling {self.name} to {self.directory}')
+        self.start = time.perf_counter()
+        tracemalloc.start(TRACE_FRAMES)
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+        threading.setprofile(self.profile_thread)
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        profile.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.profiles[0].disable()
+        threading.setprofile(None)
+        self.done.set()
+        self.sampler.join()
+        self.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.write_profile()
+        self.write_allocations(peak)
+
+    def get_path(self, suffix):
+        return os.path.join(self.directory, f'{self.name}{suffix}')
+
+    def write_profile(self):
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(self.get_path('.prof'))
+        text = io.StringIO()
+        stats.stream = text
+        stats.sort_stats('cumulative').print_stats(self.top)
+        stats.sort_stats('tottime').print_stats(self.top)
+        with open(self.get_path('.profile.txt'), 'w') as f:
+            f.write(text.getvalue())
+        logger.info(f"Profile of {self.name} written to {self.get_path('.prof')}")
+
+    def write_allocations(self, peak):
+        snapshot = self.snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        with open(self.get_path('.allocations.txt'), 'w') as f:
+            f.write(f'Peak traced memory: {peak / 1024 ** 2:.1f}MB\n')
+            f.write(f'Largest snapshot: {self.snapshot_size / 1024 ** 2:.1f}MB after {self.snapshot_time:.1f}s\n\n')
+            for statistic in snapshot.statistics('lineno')[:self.top]:
+                f.write(f'{statistic}\n')
+            f.write('\nTracebacks of the top 5:\n')
+            for statistic in snapshot.statistics('traceback')[:5]:
+                f.write(f'\n{statistic.count} blocks, {statistic.size / 1024:.1f}KiB\n')
+                f.write('\n'.join(statistic.traceback.format()) + '\n')
+        logger.info(f"Allocations of {self.name} written to {self.get_path('.allocations.txt')}")
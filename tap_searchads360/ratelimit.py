@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+import singer
+
+logger = singer.get_logger()
+DEFAULT_RATE = 10 # requests per second
+DEFAULT_BURST = 10
+MIN_RATE = 0.1
+DECREASE_FACTOR = 0.5 # rate kept after a 429
+INCREASE_RATIO = 0.01 # part of the max rate added back after each success
+DECREASE_INTERVAL = 1 # 429 received within a second of a decrease are the same overload
+
+
+class RateLimiter:
+    """
+        Token bucket shared by all the requests of a client, rate tokens per second up to burst.
+        The rate is halved on a 429 and grows back a little after each success (AIMD), so the requests
+        stay close to the quota without all retrying at the same time.
+    """
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.decreased = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """ Take a token and return the seconds to wait before using it """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            # the waiting callers are queued behind each other
+            return max(0, -self.tokens / self.rate)
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self):
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+    def on_success(self):
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * INCREASE_RATIO)
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.decreased < DECREASE_INTERVAL:
+                return
+            self.decreased = now
+            self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+            # no more burst until the rate recovers
+            self.tokens = min(self.tokens, 0)
+        logger.info(f'Too many requests, rate limited to {self.rate:.2f} requests/sec')
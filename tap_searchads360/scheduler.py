@@ -0,0 +1,56 @@
+import singer
+
+logger = singer.get_logger()
+DEFAULT_MAX_WORKERS = 4
+
+
+class ReportScheduler:
+    """
+        Request every report of the selected streams up front and wait for them concurrently.
+        Google generates the reports server-side in parallel, a single poller checks all the pending reports
+        (max_workers status checks at a time) while records are written stream by stream, so SCHEMA/RECORD/STATE stay in order.
+    """
+    def __init__(self, client, max_workers=DEFAULT_MAX_WORKERS):
+        self.client = client
+        self.max_workers = max_workers
+        self.streams = []
+
+    def add(self, stream, metadata):
+        columns, metadata = stream.selected_properties(metadata, fields=stream.fields)
+        self.streams.append((stream, columns, stream.get_reports(columns)))
+
+    def submit(self, report):
+        if report['saved_report_id']:
+            logger.info(f"Saved report: {report['saved_report_id']}")
+            return report['saved_report_id']
+        logger.info(f"Request a report from {report['start_date']} to {report['end_date']}")
+        logger.info(report['request_body'])
+        report_id = self.client.request_report(report['request_body'])
+        logger.info(f'Requested report: {report_id}')
+        return report_id
+
+    def run(self):
+        poller = self.client.get_poller(max_workers=self.max_workers) if self.client else None
+        # submit all reports first, generation starts on google side right away
+        jobs = []
+        for stream, columns, reports in self.streams:
+            stream_jobs = []
+            for report in reports:
+                cached_report = stream.get_cached_report(report)
+                if cached_report:
+                    stream_jobs.append((report, *cached_report))
+                elif not stream.config.get('replay'):
+                    report_id = self.submit(report)
+                    poller.add(report_id)
+                    stream_jobs.append((report, report_id, None))
+            jobs.append((stream, columns, stream_jobs))
+
+        for stream, columns, reports in jobs:
+            with stream.profile():
+                logger.info(f'syncing {stream.name}')
+                stream.write_schema(columns)
+                for report, report_id, files in reports:
+                    if files is None:
+                        with stream.stats.timer('poll_wait'):
+                            files = poller.wait(report_id)
+                    stream.sync_report(report, report_id, files, columns)
@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+import singer
+from contextlib import contextmanager
+
+logger = singer.get_logger()
+PHASE_METRIC = 'phase_duration'
+
+
+class SyncStats:
+    """
+        Time spent and counters of a sync, per phase: request, poll_wait, download, parse, convert and emit.
+        Gauges keep the mean and max of a sampled value, e.g. the depth of the queues between the stages.
+        Thread safe, the values are summed over all the threads. bind() returns a view sharing the same values
+        that adds its tags (e.g. the stream name) to everything it records.
+    """
+    def __init__(self, tags=None, parent=None):
+        self.tags = tags or {}
+        if parent is None:
+            self.lock = threading.Lock()
+            self.timers = {}
+            self.counters = {}
+            self.gauges = {}
+        else:
+            self.lock, self.timers, self.counters, self.gauges = parent.lock, parent.timers, parent.counters, parent.gauges
+
+    def bind(self, **tags):
+        return SyncStats({**self.tags, **tags}, parent=self)
+
+    def get_key(self, name, tags):
+        return name, tuple(sorted({**self.tags, **tags}.items()))
+
+    def add_time(self, phase, seconds, **tags):
+        key = self.get_key(phase, tags)
+        with self.lock:
+            timer = self.timers.setdefault(key, [0.0, 0])
+            timer[0] += seconds
+            timer[1] += 1
+
+    @contextmanager
+    def timer(self, phase, **tags):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start, **tags)
+
+    def increment(self, counter, value=1, **tags):
+        key = self.get_key(counter, tags)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, gauge, value, **tags):
+        key = self.get_key(gauge, tags)
+        with self.lock:
+            values = self.gauges.setdefault(key, [0, 0, value])
+            values[0] += value
+            values[1] += 1
+            values[2] = max(values[2], value)
+
+    def log(self):
+        """ Log every timer, counter and gauge as a singer metric """
+        with self.lock:
+            timers, counters, gauges = list(self.timers.items()), list(self.counters.items()), list(self.gauges.items())
+        for (phase, tags), (seconds, count) in timers:
+            singer.metrics.log(logger, singer.metrics.Point('timer', PHASE_METRIC, round(seconds, 3), {**dict(tags), 'phase': phase, 'count': count}))
+        for (counter, tags), value in counters:
+            singer.metrics.log(logger, singer.metrics.Point('counter', counter, value, dict(tags)))
+        for (gauge, tags), (total, count, maximum) in gauges:
+            singer.metrics.log(logger, singer.metrics.Point('gauge', gauge, round(total / count, 2), {**dict(tags), 'max': maximum, 'count': count}))
+
+    def summary(self):
+        """ Timers, counters and gauges by stream, the values recorded outside of any stream are under 'client' """
+        summary = {}
+        with self.lock:
+            timers, counters, gauges = list(self.timers.items()), list(self.counters.items()), list(self.gauges.items())
+        for (phase, tags), (seconds, count) in timers:
+            tags = dict(tags)
+            stream = summary.setdefault(tags.pop('stream', 'client'), {'timers': {}, 'counters': {}, 'gauges': {}})
+            name = '.'.join([phase, *(str(tag) for tag in tags.values())])
+            stream['timers'][name] = {'seconds': round(seconds, 3), 'count': count}
+        for (counter, tags), value in counters:
+            tags = dict(tags)
+            stream = summary.setdefault(tags.pop('stream', 'client'), {'timers': {}, 'counters': {}, 'gauges': {}})
+            name = '.'.join([counter, *(str(tag) for tag in tags.values())])
+            stream['counters'][name] = value
+        for (gauge, tags), (total, count, maximum) in gauges:
+            tags = dict(tags)
+            stream = summary.setdefault(tags.pop('stream', 'client'), {'timers': {}, 'counters': {}, 'gauges': {}})
+            name = '.'.join([gauge, *(str(tag) for tag in tags.values())])
+            stream['gauges'][name] = {'mean': round(total / count, 2), 'max': maximum, 'count': count}
+        return summary
+
+    def write_summary(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+        logger.info(f'Sync metrics written to {path}')
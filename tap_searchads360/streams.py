@@ -1,15 +1,30 @@
 import os
+import functools
+import itertools
+import contextlib
 import singer
 import hashlib
 import json
 from copy import copy
 from datetime import datetime, timedelta
+from .client import ReportReader
+from .cache import ReportCache, CACHE_PREFIX
+from .files import FilesReader, read_batches, DEFAULT_FILE_WORKERS, BATCH_ROWS, QUEUE_BATCHES
+from .writer import RecordWriter, BATCH_RECORDS, EMIT_QUEUE, encoder
+from .stats import SyncStats
 
 
 logger = singer.get_logger()
 
 
 LIMIT_DAYS_PER_REPORT = 365
+MAX_ROWS_PER_FILE = 100000000 # max rows value
+CHECKPOINT_ROWS = 100000 # write the position in the current file every n rows
+DATE_CACHE_SIZE = 4096 # distinct dates memoized per converter
+AGENCY_BOOKMARK = 'agency' # progress of the agency reports, each advertiser has its own date bookmark
+
+# replication keys the API can filter on, the rows before the bookmark are not downloaded
+FILTERABLE_REPLICATION_KEYS = ['lastModifiedTimestamp', 'creationTimestamp']
 
 SPECIFIC_REPLICATION_KEYS = [
     {'conversion': 'conversionDate'},
@@ -71,6 +86,21 @@ AVAILABLE_STREAMS = [
     'visit'
 ]
 
+# schema registry: each schema file is parsed once per process
+SCHEMAS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'schemas')
+
+@functools.lru_cache(maxsize=None)
+def get_schema(name):
+    return singer.utils.load_json(os.path.join(SCHEMAS_PATH, f'{name}.json'))
+
+@functools.lru_cache(maxsize=None)
+def get_properties(name):
+    return frozenset(get_schema(name)['properties'])
+
+@functools.lru_cache(maxsize=None)
+def get_segments(name):
+    return frozenset(AVAILABLE_SEGMENT[name])
+
 # helpers
 def converting_value(value, type):
     try:
@@ -88,6 +118,48 @@ def converting_value(value, type):
     except:
         return str(value)
 
+def casting(cast):
+    def cast_value(value):
+        try:
+            return cast(value)
+        except (TypeError, ValueError, OverflowError):
+            return str(value)
+    # used by the pandas engine to cast a whole column
+    cast_value.type = cast
+    return cast_value
+
+CASTS = {
+    'string': str,
+    'boolean': casting(bool),
+    'number': casting(float),
+    'integer': casting(int)
+}
+
+class RecordConverter:
+    """
+        Same conversion as converting_value, but the cast of each selected column is resolved once from the schema.
+        The latest dates are memoized: a date column only has a few hundred distinct values, but the timestamps
+        (creationTimestamp, visitTimestamp..) have about one per row and would fill the memory of a long report.
+    """
+    def __init__(self, schema, columns):
+        self.columns = tuple(columns)
+        self.convert_date = functools.lru_cache(maxsize=DATE_CACHE_SIZE)(self.convert_date)
+        self.casts = tuple(self.get_cast(schema['properties'][column]) for column in self.columns)
+
+    def get_cast(self, type):
+        if type.get('format') == 'date-time':
+            return self.convert_date
+        try:
+            return CASTS.get(type['type'][1], lambda value: None)
+        except (KeyError, IndexError, TypeError):
+            return str
+
+    def convert_date(self, value):
+        return converting_value(value, {'format': 'date-time'})
+
+    def __call__(self, line):
+        return {column: (cast(value) if value else None) for column, cast, value in zip(self.columns, self.casts, line)}
+
 def parsing_filter_value(value, check_type = int):
     # try casting type from jsonconfig
     try:
@@ -109,7 +181,7 @@ class Stream:
     forced_replication_method = 'INCREMENTAL'
     valid_replication_keys = []
 
-    def __init__(self, name, client=None, config=None, catalog_stream=None, state=None):
+    def __init__(self, name, client=None, config=None, catalog_stream=None, state=None, cache=None, stats=None, pool=None):
         if name not in AVAILABLE_STREAMS:
             raise f"The stream {name} doesn't exists"
         self.name = name
@@ -117,24 +189,42 @@ class Stream:
         self.config = config
         self.catalog_stream = catalog_stream
         self.state = state
+        self.cache = cache
+        # timers and counters of the stream
+        self.stats = (stats or SyncStats()).bind(stream=name)
+        # processes converting the csv rows, None to convert them in this process
+        self.pool = pool
+        self.writer = RecordWriter(name, batch_size=int((config or {}).get('record_batch_size', BATCH_RECORDS)),
+                                   queue_size=int((config or {}).get('emit_queue', EMIT_QUEUE)), stats=self.stats)
 
     def get_abs_path(self, path):
         return os.path.join(os.path.dirname(os.path.realpath(__file__)), path)
 
     def load_schema(self):
-        schema_path = self.get_abs_path('schemas')
-        return singer.utils.load_json('{}/{}.json'.format(schema_path, self.name))
+        # shallow copy of the shared schema, callers only replace its top level keys
+        return dict(get_schema(self.name))
 
     def write_schema(self, columns=None):
         schema = self.load_schema()
         if columns:
             selected_properties = {prop[0]: prop[1] for prop in schema['properties'].items() if prop[0] in columns}
             schema['properties'] = selected_properties
+        self.writer.flush()
         return singer.write_schema(stream_name=self.name, schema=schema, key_properties=self.key_properties)
 
     def write_state(self):
+        # records before the state must be written first
+        self.writer.flush()
         return singer.write_state(self.state)
 
+    def profile(self):
+        """ cProfile and tracemalloc of the sync of the stream when profile_dir is set, nothing otherwise """
+        if not self.config.get('profile_dir'):
+            return contextlib.nullcontext()
+        # only imported when profiling
+        from .profiling import Profiler
+        return Profiler(self.config['profile_dir'], self.name)
+
     
 class SearchAdsStream(Stream):
     valid_replication_keys = ['lastModifiedTimestamp']
@@ -147,6 +237,13 @@ class SearchAdsStream(Stream):
     def __init__(self, name, **kwargs):
         super().__init__(name, **kwargs)
         self.key_properties = [name+'Id']
+        self.max_dates = {}
+        # rows and days of the reports read from the start by advertiser, for rows_per_day
+        self.volumes = {}
+        self.converter = None
+        # rows already written of the advertiser being synced, identified by the key and segment columns
+        self.changes = None
+        self.identity_columns = ()
 
         # set replication_method
         if 'full_table_replication' in self.config and self.config['full_table_replication']:
@@ -154,8 +251,7 @@ class SearchAdsStream(Stream):
             self.forced_replication_method = 'FULL_TABLE'
 
         # setting up custom_report, filters and replication_key
-        if 'custom_report' in self.config:
-            custom_reports = [custom_report for custom_report in self.config['custom_report'] if name == custom_report['name']]
+        custom_reports = [custom_report for custom_report in self.config.get('custom_report', []) if name == custom_report['name']]
         self.set_options(self.config, custom_reports[0] if custom_reports else None)
 
         # set replicat_method for reports that have specific properties and can't be change
@@ -175,9 +271,8 @@ class SearchAdsStream(Stream):
 
         # set replication key
         if 'replication_key' in config:
-            schema = self.load_schema()
             # check if exists
-            if any([prop for prop in schema['properties'] if prop == config['replication_key']]):
+            if config['replication_key'] in get_properties(self.name):
                 if self.fields and config['replication_key'] not in self.fields:
                     raise Exception('Replication key must be in the report field selection. Please check your config file')
                 self.replication_key = config['replication_key']
@@ -193,12 +288,12 @@ class SearchAdsStream(Stream):
         """
         mdata, columns, selected_fields = metadata, [], []
         # add selected false to properties we don't want
-        schema = self.load_schema()
         if fields:
-            selected_fields = fields
+            selected_fields = set(fields)
         else:
             # select all except segments
-            selected_fields = [prop for prop in schema['properties'] if prop not in AVAILABLE_SEGMENT[self.name] or prop == self.replication_key]
+            segments = get_segments(self.name)
+            selected_fields = {prop for prop in get_properties(self.name) if prop not in segments or prop == self.replication_key}
          
         for field in mdata:
             if field['breadcrumb']:
@@ -208,12 +303,15 @@ class SearchAdsStream(Stream):
                     columns.pop(-1)
         return columns, mdata
 
-    def write(self, metadata):
-        columns, metadata = self.selected_properties(metadata, fields=self.fields)
-        self.write_schema(columns)
-        self.sync(columns, metadata)
+    def get_days_per_report(self, bookmark, columns):
+        """ Number of days per report to get about rows_per_report rows, from the volume of the previous run """
+        rows_per_report = self.config.get('rows_per_report')
+        # without the date segment the rows are aggregated over the whole range: a shorter report has as many rows
+        if not rows_per_report or not bookmark.get('rows_per_day') or 'date' not in columns:
+            return LIMIT_DAYS_PER_REPORT
+        return max(1, min(LIMIT_DAYS_PER_REPORT, int(int(rows_per_report) / bookmark['rows_per_day'])))
 
-    def get_date_range_request(self, start_date, end_date):
+    def get_date_range_request(self, start_date, end_date, limit_days=LIMIT_DAYS_PER_REPORT):
         #check start_date and end_date offset
         if start_date >= end_date:
             raise DateRangeError(f"start_date should be at least 1 days ago")
@@ -224,8 +322,8 @@ class SearchAdsStream(Stream):
         days = delta.days
         dates = []
         end_range = end
-        while days > LIMIT_DAYS_PER_REPORT:
-            end_range = start + timedelta(days=LIMIT_DAYS_PER_REPORT)
+        while days > limit_days:
+            end_range = start + timedelta(days=limit_days)
             dates.append(
                 (f'{start.year}-{start.month:02}-{start.day:02}T00:00:00Z',
                  f'{end_range.year}-{end_range.month:02}-{end_range.day:02}T00:00:00Z')
@@ -252,7 +350,7 @@ class SearchAdsStream(Stream):
                 'endDate': end_date
             },
             'downloadFormat': 'CSV',
-            'maxRowsPerFile': 100000000,  # max rows value
+            'maxRowsPerFile': int(self.config.get('max_rows_per_file', MAX_ROWS_PER_FILE)),
             'statisticsCurrency': self.config['currency'] if 'currency' in self.config and self.config['currency'] in ('agency', 'advertiser', 'account', 'usd') else 'usd' # noqa
         }
         if self.name != 'advertiser': # need the specific list here noqa
@@ -286,70 +384,411 @@ class SearchAdsStream(Stream):
                 bookmark['date'] = f'{start.year}-{start.month:02}-{start.day:02}T00:00:00Z'
         return bookmark
 
-    def sync(self, columns, mdata):
-        logger.info(f'syncing {self.name}')
-        schema = self.load_schema()
-        advertiser_ids = self.config['advertiser_id'] if  isinstance(self.config['advertiser_id'], list) else [self.config['advertiser_id']]
-        for advertiser_id in advertiser_ids:
-            bookmark = self.get_bookmark(advertiser_id)
+    def get_incremental_filter(self, start_date, columns):
+        """ API filter on the replication key for the rows after start_date, None if the rows are checked client side """
+        # the API rejects a filter on a column the report doesn't have, e.g. lastModifiedTimestamp of conversion or visit
+        if self.replication_method != 'INCREMENTAL'\
+        or self.replication_key not in FILTERABLE_REPLICATION_KEYS\
+        or self.replication_key not in get_properties(self.name)\
+        or self.replication_key not in columns\
+        or not self.config.get('filter_pushdown', True):
+            return None
+        # same as the client side check: only the days after start_date
+        next_day = datetime.strptime(start_date[:10], '%Y-%m-%d') + timedelta(days=1)
+        return {
+            "column": {"columnName": self.replication_key},
+            "operator": 'greaterThanOrEquals',
+            "values": [next_day.strftime('%Y-%m-%dT%H:%M:%SZ')],
+        }
 
-            yesterday = datetime.now() - timedelta(days=1)
+    def add_filter(self, request_body, payload_filter):
+        # custom_report filters and the ones added by the tap are all applied
+        request_body.setdefault('filters', []).append(payload_filter)
+
+    def get_advertiser_ids(self):
+        return self.config['advertiser_id'] if isinstance(self.config['advertiser_id'], list) else [self.config['advertiser_id']]
+
+    def get_end_date(self):
+        yesterday = datetime.now() - timedelta(days=1)
+        return self.config['end_date'][:10] if 'end_date' in self.config and self.config['end_date'] else str(yesterday.strftime('%Y-%m-%d'))
+
+    def get_saved_report_id(self, bookmark):
+        # bookmark report_id, if something wrong happen use it to get files again
+        if bookmark.get('report_id', None)\
+        and not bookmark.get('complete', False)\
+        and bookmark.get('offset') < bookmark.get('file_count')\
+        and bookmark['extract_date'][:10] == str(datetime.now())[:10]\
+        and not bookmark['report_id'].startswith(CACHE_PREFIX):
+            return bookmark.get('report_id')
+        return None
+
+    def get_reports(self, columns):
+        """
+            List every report needed by the stream: one per advertiser and per date range.
+            The first report of an advertiser reuses the bookmarked report_id if a previous run failed the same day.
+        """
+        if self.config.get('agency_report'):
+            return self.get_agency_reports(columns)
+
+        reports = []
+        for advertiser_id in self.get_advertiser_ids():
+            bookmark = self.get_bookmark(advertiser_id)
             start_date = bookmark['date'][:10]
-            end_date = self.config['end_date'][:10] if 'end_date' in self.config and self.config['end_date'] else str(yesterday.strftime('%Y-%m-%d'))
-            max_date = bookmark['date'][:10]
-
-            # get date ranges split into multiple dates ranges of 365 days interval
-            date_ranges = self.get_date_range_request(start_date, end_date)
-            for start_date, end_date in date_ranges:
-                bookmark = self.get_bookmark(advertiser_id)
-                report_id = ''
-                files = []
-                logger.info(f'Request a report from {start_date} to {end_date}')
+            end_date = self.get_end_date()
+
+            # get date ranges split into multiple dates ranges of 365 days interval at most
+            limit_days = self.get_days_per_report(bookmark, columns)
+            if limit_days < LIMIT_DAYS_PER_REPORT:
+                logger.info(f"{bookmark['rows_per_day']} rows per day for advertiser {advertiser_id}, reports of {limit_days} days")
+            date_ranges = self.get_date_range_request(start_date, end_date, limit_days=limit_days)
+            for count, (start_date, end_date) in enumerate(date_ranges):
                 request_body = self.request_body(self.config['agency_id'], advertiser_id, columns, start_date[:10], end_date[:10], filters=self.filters)
-                logger.info(request_body)
-                # bookmark report_id, if something wrong happen use it to get files again
-                if bookmark.get('report_id', None)\
-                and not bookmark.get('complete', False)\
-                and bookmark.get('offset') < bookmark.get('file_count')\
-                and bookmark['extract_date'][:10] == str(datetime.now())[:10]:
-                    report_id, files = self.client.get_report_files(saved_report_id=bookmark.get('report_id'))
-
-                if not report_id and not files:
-                    report_id, files = self.client.get_report_files(request_body)
-                    bookmark.update({
-                        'report_id': report_id,
-                        'file_count': len(files),
-                        'offset': 0,
-                        'extract_date': str(datetime.now())[:10],
-                        'complete': False
-                    })
-                logger.info(f'Report {report_id} contain {len(files)} files')
-                
-                new_bookmark = copy(bookmark)
-                for count, file in enumerate(files):
-                    if bookmark['offset'] > count:
-                        continue
-                        
-                    data = self.client.extract_data(file.get('url'))
-                    logger.info(f'Writing records for {self.name} from file : '+file.get('url'))
-                    with singer.metrics.job_timer(job_type=f'list_{self.name}') as timer:
-                        with singer.metrics.record_counter(endpoint=self.name) as counter:
-                            for line_count, line in enumerate(data):
-                                if line_count == 0:
-                                    # remove first line
-                                    continue
-                                dict = {key: (converting_value(value, schema['properties'][key]) if value else None) for (key, value) in zip(columns, line)}
-                                max_date = max(max_date, dict.get(self.replication_key, ''))
-                                if (self.replication_method == 'INCREMENTAL' and dict.get(self.replication_key, '')[:10] > start_date[:10]) or self.replication_method == 'FULL_TABLE':
-                                    singer.write_record(stream_name=self.name, time_extracted=singer.utils.now(), record=dict)
-                                    counter.increment()
-                    # save between each file for retry purpose
-                    new_bookmark['offset'] += 1
-                    self.state = singer.write_bookmark(self.state, self.name, advertiser_id, new_bookmark)
-                    self.write_state()
-                # when everything is done save the date, we can't order by column only with synchronous report
-                new_bookmark['date'] = max_date
-                new_bookmark['complete'] = True
-                self.state = singer.write_bookmark(self.state, self.name, advertiser_id, new_bookmark)
-                self.write_state()
-
+                incremental_filter = self.get_incremental_filter(start_date, columns)
+                if incremental_filter:
+                    self.add_filter(request_body, incremental_filter)
+                reports.append({
+                    'advertiser_id': advertiser_id,
+                    'start_date': start_date,
+                    'end_date': end_date,
+                    'request_body': request_body,
+                    'filtered': incremental_filter is not None,
+                    'saved_report_id': self.get_saved_report_id(bookmark) if count == 0 else None
+                })
+        return reports
+
+    def get_agency_reports(self, columns):
+        """
+            One report per date range for the whole agency, or for the advertisers of the config.
+            The advertiserId column is used to split the rows between the advertiser bookmarks,
+            the progress of the report itself is bookmarked under AGENCY_BOOKMARK.
+        """
+        advertiser_ids = [str(advertiser_id) for advertiser_id in self.get_advertiser_ids() if advertiser_id] if self.config.get('advertiser_id') else []
+        bookmark = self.get_bookmark(AGENCY_BOOKMARK)
+        start_dates = {advertiser_id: self.get_bookmark(advertiser_id)['date'][:10] for advertiser_id in advertiser_ids}
+        start_date = min(start_dates.values()) if start_dates else bookmark['date'][:10]
+        report_columns = columns if 'advertiserId' in columns else columns + ['advertiserId']
+
+        limit_days = self.get_days_per_report(bookmark, report_columns)
+        date_ranges = self.get_date_range_request(start_date, self.get_end_date(), limit_days=limit_days)
+        reports = []
+        for count, (start_date, end_date) in enumerate(date_ranges):
+            request_body = self.request_body(self.config['agency_id'], None, report_columns, start_date[:10], end_date[:10], filters=self.filters)
+            if advertiser_ids:
+                self.add_filter(request_body, {
+                    "column": {"columnName": 'advertiserId'},
+                    "operator": 'in',
+                    "values": [parsing_filter_value(advertiser_id) for advertiser_id in advertiser_ids],
+                })
+            # advertisers can have later bookmarks, they are still checked client side
+            incremental_filter = self.get_incremental_filter(start_date, report_columns)
+            if incremental_filter:
+                self.add_filter(request_body, incremental_filter)
+            reports.append({
+                'advertiser_id': AGENCY_BOOKMARK,
+                'advertiser_column': report_columns.index('advertiserId'),
+                'start_dates': start_dates,
+                'start_date': start_date,
+                'end_date': end_date,
+                'request_body': request_body,
+                'saved_report_id': self.get_saved_report_id(bookmark) if count == 0 else None
+            })
+        return reports
+
+    def get_cached_report(self, report):
+        """ Return the report_id and files of the report if it is in the cache, None otherwise """
+        if not self.cache:
+            return None
+        key = ReportCache.get_key(report['request_body'])
+        # replay the cache whatever its age
+        files = self.cache.get_files(key, ttl=not self.config.get('replay'))
+        if files is None:
+            if self.config.get('replay'):
+                logger.warning(f"Report from {report['start_date']} to {report['end_date']} is not in the cache, skipped")
+            return None
+        logger.info(f"Report from {report['start_date']} to {report['end_date']} found in cache: {key}")
+        return CACHE_PREFIX + key, files
+
+    def get_converter(self, columns):
+        # built once per stream, the date cache is shared by all its reports
+        if self.converter is None:
+            self.converter = RecordConverter(self.load_schema(), columns)
+        return self.converter
+
+    def get_change_index(self, advertiser_id):
+        if not self.config.get('change_index_dir'):
+            return None
+        # numpy is only imported when used
+        from .changes import ChangeIndex, DEFAULT_MAX_ROWS
+        os.makedirs(self.config['change_index_dir'], exist_ok=True)
+        path = os.path.join(self.config['change_index_dir'], f'{self.name}_{advertiser_id}.digests')
+        return ChangeIndex(path, max_rows=int(self.config.get('change_index_max_rows', DEFAULT_MAX_ROWS)), stats=self.stats)
+
+    def get_identity_columns(self, columns):
+        # a row is the same row from one sync to the next when these values are the same
+        segments = get_segments(self.name)
+        return tuple(column for column in columns if column in self.key_properties or column in segments)
+
+    def write_record(self, record, counter, identity=None):
+        """ Write a record encoded in json, unless the same row was already written with the same content by a previous sync """
+        if self.changes is None or self.changes.is_new(identity, record):
+            self.writer.write_encoded(record)
+            counter.increment()
+
+    def write_dict(self, record, counter):
+        identity = None
+        if self.changes is not None and self.identity_columns:
+            identity = encoder.encode([record.get(column) for column in self.identity_columns])
+        self.write_record(encoder.encode(record), counter, identity)
+
+    def write_lines(self, lines, converter, start_date, max_date, counter, filtered=False):
+        """ Write the records of the lines and return the max date, filtered lines are already after start_date """
+        incremental = self.replication_method == 'INCREMENTAL' and not filtered
+        with self.stats.timer('convert'):
+            records = [converter(line) for line in lines]
+        with self.stats.timer('emit'):
+            for dict in records:
+                max_date = max(max_date, dict.get(self.replication_key, ''))
+                if (incremental and dict.get(self.replication_key, '')[:10] > start_date[:10]) or not incremental:
+                    self.write_dict(dict, counter)
+        return max_date
+
+    def get_frame_dates(self, frame, converter):
+        # raw dates of the replication key, YYYY-MM-DD sorts the same way as its conversion
+        if self.replication_key not in converter.columns:
+            return None
+        return frame[converter.columns.index(self.replication_key)]
+
+    def write_frame(self, frame, converter, start_date, max_date, counter, filtered=False):
+        """ Same as write_lines for a DataFrame of the pandas engine, dates are compared on whole columns """
+        incremental = self.replication_method == 'INCREMENTAL' and not filtered
+        with self.stats.timer('convert'):
+            dates = self.get_frame_dates(frame, converter.converter)
+            if dates is not None:
+                present = dates[dates != '']
+                if len(present):
+                    max_date = max(max_date, converter.converter.convert_date(present.max()))
+            if incremental:
+                frame = frame[dates.str[:10] > start_date[:10]] if dates is not None else frame.iloc[0:0]
+            records = converter.serialize(frame)
+        with self.stats.timer('emit'):
+            if self.changes is not None:
+                records = self.changes.filter(records, converter.serialize_columns(frame, self.identity_columns) if self.identity_columns else None)
+            for record in records:
+                self.writer.write_encoded(record)
+            counter.increment(len(records))
+        return max_date
+
+    def write_agency_frame(self, frame, converter, report, counter):
+        """ Same as write_agency_lines for a DataFrame of the pandas engine """
+        advertiser_column, start_dates, start_date = report['advertiser_column'], report['start_dates'], report['start_date'][:10]
+        max_date = ''
+        with self.stats.timer('convert'):
+            advertisers = frame[advertiser_column]
+            if advertisers.dtype != object:
+                # parsed as numbers, the advertisers are strings in the state
+                advertisers = advertisers.astype(str)
+            for advertiser_id in advertisers.unique():
+                if advertiser_id not in start_dates:
+                    start_dates[advertiser_id] = self.get_bookmark(advertiser_id)['date'][:10]
+                    self.max_dates.setdefault(advertiser_id, start_dates[advertiser_id])
+            dates = self.get_frame_dates(frame, converter.converter)
+            if dates is None:
+                # no date in the report, same as empty dates
+                dates = advertisers.str[:0]
+            present = dates != ''
+            for advertiser_id, date in dates[present].groupby(advertisers[present]).max().items():
+                date = converter.converter.convert_date(date)
+                self.max_dates[advertiser_id] = max(self.max_dates[advertiser_id], date)
+                max_date = max(max_date, date)
+            if self.replication_method == 'INCREMENTAL':
+                frame = frame[dates.str[:10] > advertisers.map({advertiser_id: max(start_date, date) for advertiser_id, date in start_dates.items()})]
+            elif self.replication_method != 'FULL_TABLE':
+                frame = frame.iloc[0:0]
+            records = converter.serialize(frame)
+        with self.stats.timer('emit'):
+            if self.changes is not None:
+                records = self.changes.filter(records, converter.serialize_columns(frame, self.identity_columns) if self.identity_columns else None)
+            for record in records:
+                self.writer.write_encoded(record)
+            counter.increment(len(records))
+        return max_date
+
+    def write_converted(self, batch, converter, start_date, max_date, counter, filtered=False):
+        """ Same as write_lines for a RecordBatch converted by a process, the records are already in json """
+        incremental = self.replication_method == 'INCREMENTAL' and not filtered
+        self.stats.add_time('convert', batch.seconds)
+        with self.stats.timer('emit'):
+            for record, date, identity in zip(batch.records, batch.dates, batch.identities or itertools.repeat(None)):
+                max_date = max(max_date, date)
+                if (incremental and date[:10] > start_date[:10]) or not incremental:
+                    self.write_record(record, counter, identity)
+        return max_date
+
+    def write_agency_converted(self, batch, converter, report, counter):
+        """ Same as write_agency_lines for a RecordBatch converted by a process """
+        start_dates, start_date = report['start_dates'], report['start_date'][:10]
+        max_date = ''
+        self.stats.add_time('convert', batch.seconds)
+        with self.stats.timer('emit'):
+            for record, date, advertiser_id, identity in zip(batch.records, batch.dates, batch.advertisers, batch.identities or itertools.repeat(None)):
+                if advertiser_id not in start_dates:
+                    start_dates[advertiser_id] = self.get_bookmark(advertiser_id)['date'][:10]
+                    self.max_dates.setdefault(advertiser_id, start_dates[advertiser_id])
+                self.max_dates[advertiser_id] = max(self.max_dates[advertiser_id], date)
+                max_date = max(max_date, date)
+                if (self.replication_method == 'INCREMENTAL' and date[:10] > max(start_date, start_dates[advertiser_id])) or self.replication_method == 'FULL_TABLE':
+                    self.write_record(record, counter, identity)
+        return max_date
+
+    def write_agency_lines(self, lines, converter, report, counter):
+        """ Same as write_lines for an agency report, the dates are checked and kept per advertiser """
+        advertiser_column, start_dates, start_date = report['advertiser_column'], report['start_dates'], report['start_date'][:10]
+        max_date = ''
+        with self.stats.timer('convert'):
+            records = [converter(line) for line in lines]
+        with self.stats.timer('emit'):
+            for line, dict in zip(lines, records):
+                advertiser_id = line[advertiser_column]
+                if advertiser_id not in start_dates:
+                    start_dates[advertiser_id] = self.get_bookmark(advertiser_id)['date'][:10]
+                    self.max_dates.setdefault(advertiser_id, start_dates[advertiser_id])
+                date = dict.get(self.replication_key, '')
+                self.max_dates[advertiser_id] = max(self.max_dates[advertiser_id], date)
+                max_date = max(max_date, date)
+                if (self.replication_method == 'INCREMENTAL' and date[:10] > max(start_date, start_dates[advertiser_id])) or self.replication_method == 'FULL_TABLE':
+                    self.write_dict(dict, counter)
+        return max_date
+
+    def sync_report(self, report, report_id, files, columns):
+        """ Write the records of a generated report and bookmark the progress file by file """
+        converter = self.get_converter(columns)
+        advertiser_id, start_date = report['advertiser_id'], report['start_date']
+        self.changes = self.get_change_index(advertiser_id)
+        self.identity_columns = self.get_identity_columns(converter.columns)
+        bookmark = self.get_bookmark(advertiser_id)
+        # max date is kept between the date ranges of the same advertiser
+        if advertiser_id not in self.max_dates:
+            self.max_dates[advertiser_id] = bookmark['date'][:10]
+        max_date = self.max_dates[advertiser_id]
+
+        if report_id != bookmark.get('report_id'):
+            bookmark.update({
+                'report_id': report_id,
+                'file_count': len(files),
+                'offset': 0,
+                'file_bytes': 0,
+                'file_rows': 0,
+                'extract_date': str(datetime.now())[:10],
+                'complete': False
+            })
+        elif bookmark.get('max_date'):
+            # rows before the saved position are not read again
+            max_date = max(max_date, bookmark['max_date'])
+            for row_advertiser_id, date in bookmark.get('max_dates', {}).items():
+                self.max_dates[row_advertiser_id] = max(self.max_dates.get(row_advertiser_id, date), date)
+        # agency report, rows are split between the advertisers
+        agency_report = report.get('advertiser_column') is not None
+        if agency_report:
+            for row_advertiser_id, date in report['start_dates'].items():
+                self.max_dates.setdefault(row_advertiser_id, date)
+        logger.info(f'Report {report_id} contain {len(files)} files')
+
+        checkpoint_rows = int(self.config.get('checkpoint_rows', CHECKPOINT_ROWS))
+        # rows of the report are only counted when it is read from the start
+        resumed, report_rows = bool(bookmark['offset'] or bookmark.get('file_bytes')), 0
+        new_bookmark = copy(bookmark)
+        # keep a copy of the files, unless some of them have already been read by a previous run
+        cache_writer = None
+        if self.cache and not report_id.startswith(CACHE_PREFIX) and not new_bookmark['offset'] and not new_bookmark.get('file_bytes'):
+            cache_writer = self.cache.writer(ReportCache.get_key(report['request_body']), len(files))
+        readers = []
+        for count, file in enumerate(files):
+            if bookmark['offset'] > count:
+                continue
+            # resume the first file from the last saved row
+            offset = new_bookmark.get('file_bytes', 0) if not readers else 0
+            if file['url'].startswith(CACHE_PREFIX):
+                readers.append((count, ReportReader(self.cache, file['url'], offset=offset, stats=self.stats)))
+            elif cache_writer:
+                readers.append((count, ReportReader(cache_writer.tee(self.client, count), file['url'], offset=offset, stats=self.stats)))
+            else:
+                readers.append((count, self.client.extract_data(file['url'], offset=offset, stats=self.stats)))
+
+        # rows parsed by pandas and converted column by column, or parsed by csv and converted row by row, here or in the processes of the pool
+        if self.config.get('parse_engine', 'csv') == 'pandas':
+            # pandas is only imported when used
+            from .frames import read_frames, FrameConverter, FRAME_ROWS
+            converter = FrameConverter(converter)
+            read, queue_size = functools.partial(read_frames, dtypes=converter.dtypes), max(QUEUE_BATCHES * BATCH_ROWS // FRAME_ROWS, 1)
+            write_lines, write_agency_lines = self.write_frame, self.write_agency_frame
+        elif self.pool:
+            from .processes import read_converted
+            # enough blocks in flight to keep every process busy, the queue of each file only holds a few converted blocks
+            task = (self.name, converter.columns, self.replication_key, report.get('advertiser_column'), self.identity_columns if self.changes is not None else ())
+            read, queue_size = functools.partial(read_converted, pool=self.pool, task=task, ahead=int(self.config['convert_processes'])), 2
+            write_lines, write_agency_lines = self.write_converted, self.write_agency_converted
+        else:
+            read, queue_size = read_batches, QUEUE_BATCHES
+            write_lines, write_agency_lines = self.write_lines, self.write_agency_lines
+
+        # files are downloaded in parallel, but written and bookmarked in order
+        for count, batches in FilesReader(readers, max_workers=int(self.config.get('file_workers', DEFAULT_FILE_WORKERS)), queue_size=queue_size, read=read):
+            file_url = files[count]['url']
+            if new_bookmark.get('file_bytes'):
+                logger.info(f"Resume file from byte {new_bookmark['file_bytes']}, {new_bookmark.get('file_rows', 0)} rows already read")
+            logger.info(f'Writing records for {self.name} from file : '+file_url)
+            file_rows = new_bookmark.get('file_rows', 0)
+            with singer.metrics.job_timer(job_type=f'list_{self.name}') as timer:
+                with singer.metrics.record_counter(endpoint=self.name) as counter:
+                    for lines, file_bytes in batches:
+                        if agency_report:
+                            max_date = max(max_date, write_agency_lines(lines, converter, report, counter))
+                        else:
+                            max_date = write_lines(lines, converter, start_date, max_date, counter, filtered=report.get('filtered', False))
+                        file_rows += len(lines)
+                        report_rows += len(lines)
+                        if file_rows - new_bookmark.get('file_rows', 0) >= checkpoint_rows:
+                            new_bookmark.update({
+                                'file_bytes': file_bytes,
+                                'file_rows': file_rows,
+                                'max_date': max_date
+                            })
+                            if agency_report:
+                                new_bookmark['max_dates'] = copy(self.max_dates)
+                            self.state = singer.write_bookmark(self.state, self.name, advertiser_id, new_bookmark)
+                            self.write_state()
+            # save between each file for retry purpose
+            new_bookmark.update({
+                'offset': count + 1,
+                'file_bytes': 0,
+                'file_rows': 0,
+                'max_date': max_date
+            })
+            self.state = singer.write_bookmark(self.state, self.name, advertiser_id, new_bookmark)
+            self.write_state()
+        if cache_writer:
+            cache_writer.commit()
+        if not resumed and 'date' in columns:
+            # volume used to split the next reports, from all the reports of the advertiser read in this sync
+            days = (datetime.strptime(report['end_date'][:10], '%Y-%m-%d') - datetime.strptime(start_date[:10], '%Y-%m-%d')).days
+            total_rows, total_days = self.volumes.get(advertiser_id, (0, 0))
+            self.volumes[advertiser_id] = total_rows + report_rows, total_days + max(days, 1)
+            new_bookmark['rows_per_day'] = round(self.volumes[advertiser_id][0] / self.volumes[advertiser_id][1], 2)
+        # when everything is done save the date, we can't order by column only with synchronous report
+        self.max_dates[advertiser_id] = max_date
+        if agency_report:
+            new_bookmark.pop('max_dates', None)
+            for row_advertiser_id, date in self.max_dates.items():
+                if row_advertiser_id == AGENCY_BOOKMARK:
+                    continue
+                advertiser_bookmark = singer.get_bookmark(self.state, self.name, row_advertiser_id, {})
+                advertiser_bookmark.update({'date': date, 'complete': True})
+                self.state = singer.write_bookmark(self.state, self.name, row_advertiser_id, advertiser_bookmark)
+        new_bookmark['date'] = max_date
+        new_bookmark['complete'] = True
+        self.state = singer.write_bookmark(self.state, self.name, advertiser_id, new_bookmark)
+        self.write_state()
+        if self.changes is not None:
+            # the records are written, they are not written again by the next syncs
+            self.changes.save()
+            self.changes = None
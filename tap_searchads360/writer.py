@@ -0,0 +1,88 @@
+import json
+import sys
+import threading
+import singer
+from .files import StageQueue
+
+BATCH_RECORDS = 1000
+EMIT_QUEUE = 4 # batches waiting for stdout
+
+_DONE = object()
+
+# same output as singer.format_message, the encoder is built once
+encoder = json.JSONEncoder(ensure_ascii=True, allow_nan=False)
+
+
+class RecordWriter:
+    """
+        Write the RECORD messages of a stream by batches.
+        time_extracted is taken once per batch and the message is built around the serialized record,
+        batch_size messages are written to stdout at once. flush() must be called before any other message (SCHEMA, STATE).
+        With a queue_size, the batches are written by a thread of their own: a target slow to read stdout only blocks
+        the conversion when queue_size batches are waiting.
+    """
+    def __init__(self, stream_name, batch_size=BATCH_RECORDS, output=None, queue_size=0, stats=None):
+        self.prefix = '{"type": "RECORD", "stream": ' + encoder.encode(stream_name) + ', "record": '
+        self.suffix = None
+        self.batch_size = batch_size
+        self.output = output
+        self.messages = []
+        self.queue_size = queue_size
+        self.stats = stats
+        self.batches = None
+        self.thread = None
+        self.error = None
+
+    def write(self, record):
+        self.write_encoded(encoder.encode(record))
+
+    def write_encoded(self, record):
+        """ Same as write for a record already encoded in json """
+        if self.suffix is None:
+            time_extracted = singer.utils.strftime(singer.utils.now())
+            self.suffix = ', "time_extracted": ' + encoder.encode(time_extracted) + '}\n'
+        self.messages.append(self.prefix + record + self.suffix)
+        if len(self.messages) >= self.batch_size:
+            self.write_batch()
+
+    def write_batch(self):
+        if self.messages:
+            if self.queue_size:
+                self.send(''.join(self.messages))
+            else:
+                (self.output or sys.stdout).write(''.join(self.messages))
+            self.messages = []
+        self.suffix = None
+
+    def send(self, text):
+        if self.thread is None:
+            self.batches = StageQueue('emit', self.queue_size, self.stats)
+            self.thread = threading.Thread(target=self.output_batches, daemon=True)
+            self.thread.start()
+        self.batches.put(text)
+        if self.error:
+            raise self.error
+
+    def output_batches(self):
+        while True:
+            text = self.batches.get()
+            if text is _DONE:
+                return
+            try:
+                (self.output or sys.stdout).write(text)
+            except Exception as e:
+                # raised by the next send or flush, the batches left are dropped
+                self.error = e
+                self.batches.cancelled.set()
+                return
+
+    def flush(self):
+        self.write_batch()
+        if self.thread is not None:
+            # every batch is written before the next message
+            self.batches.put(_DONE)
+            self.thread.join()
+            self.thread = None
+            if self.error:
+                raise self.error
+        (self.output or sys.stdout).flush()
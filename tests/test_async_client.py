@@ -0,0 +1,74 @@
+"""
+    Access token of AsyncGoogleSearchAdsClient against a local oauth server.
+"""
+import unittest
+from unittest import mock
+import tap_searchads360.async_client as async_client
+from tap_searchads360.client import ClientHttpError
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+
+@unittest.skipIf(web is None, 'the async client needs aiohttp')
+class TestAsyncAccessToken(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        # responses of the token uri, in order, the last one is repeated
+        self.responses = []
+        self.calls = 0
+        app = web.Application()
+        app.router.add_post('/token', self.token)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        patcher = mock.patch.object(async_client, 'GOOGLE_TOKEN_URI', f'http://127.0.0.1:{port}/token')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    async def token(self, request):
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        return response()
+
+    def get_client(self, **options):
+        return async_client.AsyncGoogleSearchAdsClient('client_id', 'client_secret', refresh_token='refresh_token', **options)
+
+    async def test_refresh(self):
+        self.responses = [lambda: web.json_response({'access_token': 'token', 'expires_in': 3600})]
+        async with self.get_client() as client:
+            self.assertEqual(await client.get_access_token(), 'token')
+        self.assertEqual(self.calls, 1)
+
+    async def test_given_access_token(self):
+        self.responses = [lambda: web.json_response({'access_token': 'token', 'expires_in': 3600})]
+        async with self.get_client(access_token='given') as client:
+            self.assertEqual(await client.get_access_token(), 'given')
+            client.invalidate_token('given')
+            self.assertEqual(await client.get_access_token(), 'token')
+        self.assertEqual(self.calls, 1)
+
+    async def test_server_error_retried(self):
+        self.responses = [lambda: web.Response(status=503, text='<html>Unavailable</html>', content_type='text/html'),
+                          lambda: web.json_response({'access_token': 'token', 'expires_in': 3600})]
+        with mock.patch('asyncio.sleep', new=mock.AsyncMock()):
+            async with self.get_client() as client:
+                self.assertEqual(await client.get_access_token(), 'token')
+        self.assertEqual(self.calls, 2)
+
+    async def test_oauth_error(self):
+        self.responses = [lambda: web.json_response({'error': 'invalid_grant', 'error_description': 'Token has been expired or revoked.'}, status=400)]
+        with self.assertRaisesRegex(ClientHttpError, 'Status code 400: Token has been expired or revoked.'):
+            async with self.get_client():
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+    TokenManager: one refresh for all the threads, before the token expires or after it was rejected, kept in the cache file between runs.
+"""
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from tap_searchads360.auth import TokenManager, REFRESH_MARGIN
+
+
+class FakeRefresh:
+    """ refresh() of the client: a new token per call, valid lifetime seconds """
+    def __init__(self, lifetime=3600, delay=0.0):
+        self.lifetime = lifetime
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        time.sleep(self.delay)
+        self.calls += 1
+        return f'token{self.calls}', self.lifetime
+
+
+class TestTokenManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache_path = os.path.join(self.directory, 'tokens.json')
+
+    def test_refresh_once(self):
+        refresh = FakeRefresh()
+        tokens = TokenManager(refresh)
+        self.assertEqual(tokens.get(), 'token1')
+        self.assertEqual(tokens.get(), 'token1')
+        self.assertEqual(refresh.calls, 1)
+
+    def test_refresh_before_expiry(self):
+        refresh = FakeRefresh(lifetime=REFRESH_MARGIN + 60)
+        tokens = TokenManager(refresh)
+        self.assertEqual(tokens.get(), 'token1')
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(tokens.get(), 'token2')
+
+    def test_concurrent_refresh(self):
+        refresh = FakeRefresh(delay=0.1)
+        tokens = TokenManager(refresh)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(tokens.get())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['token1'] * 10)
+        self.assertEqual(refresh.calls, 1)
+
+    def test_invalidate(self):
+        refresh = FakeRefresh()
+        tokens = TokenManager(refresh)
+        rejected = tokens.get()
+        tokens.invalidate(rejected)
+        self.assertEqual(tokens.get(), 'token2')
+        # rejected again by a request sent before the refresh: the new token is kept
+        tokens.invalidate(rejected)
+        self.assertEqual(tokens.get(), 'token2')
+        self.assertEqual(refresh.calls, 2)
+
+    def test_get_during_invalidate(self):
+        """ The lock-free path returns the token it checked, never None """
+        refresh = FakeRefresh()
+        tokens = TokenManager(refresh)
+        done = threading.Event()
+        returned = []
+
+        def get():
+            while not done.is_set():
+                returned.append(tokens.get())
+
+        thread = threading.Thread(target=get)
+        thread.start()
+        for _ in range(200):
+            tokens.invalidate(tokens.access_token)
+            time.sleep(0.001)
+        done.set()
+        thread.join()
+        self.assertNotIn(None, returned)
+
+    def test_given_access_token(self):
+        refresh = FakeRefresh()
+        tokens = TokenManager(refresh, access_token='given')
+        # used until it is rejected, its expiry is unknown
+        self.assertEqual(tokens.get(), 'given')
+        self.assertEqual(refresh.calls, 0)
+        tokens.invalidate('given')
+        self.assertEqual(tokens.get(), 'token1')
+
+    def test_cache(self):
+        refresh = FakeRefresh()
+        self.assertEqual(TokenManager(refresh, cache_path=self.cache_path, cache_key='account').get(), 'token1')
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_path).st_mode), 0o600)
+        # the next run reuses it, another account doesn't
+        self.assertEqual(TokenManager(refresh, cache_path=self.cache_path, cache_key='account').get(), 'token1')
+        self.assertEqual(TokenManager(refresh, cache_path=self.cache_path, cache_key='other').get(), 'token2')
+        self.assertEqual(refresh.calls, 2)
+
+    def test_cache_expired(self):
+        refresh = FakeRefresh(lifetime=REFRESH_MARGIN + 60)
+        TokenManager(refresh, cache_path=self.cache_path).get()
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(TokenManager(refresh, cache_path=self.cache_path).get(), 'token2')
+
+    def test_cache_invalidated(self):
+        refresh = FakeRefresh()
+        tokens = TokenManager(refresh, cache_path=self.cache_path)
+        tokens.invalidate(tokens.get())
+        # the rejected token is not reused by the next run
+        self.assertEqual(TokenManager(refresh, cache_path=self.cache_path).get(), 'token2')
+
+    def test_cache_errors(self):
+        with open(self.cache_path, 'w') as f:
+            f.write('not json')
+        refresh = FakeRefresh()
+        self.assertEqual(TokenManager(refresh, cache_path=self.cache_path).get(), 'token1')
+        # a cache that can't be written only costs a refresh
+        self.assertEqual(TokenManager(refresh, cache_path=os.path.join(self.directory, 'missing', 'tokens.json')).get(), 'token2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+    ChangeIndex: a row is written again only when it is new or its content changed since the last sync.
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import tap_searchads360.changes as changes_module
+from tap_searchads360.changes import ChangeIndex
+from tap_searchads360.stats import SyncStats
+from tests.test_streams import CONFIG, FakeClient, keyword_rows, sync
+
+
+def row(keyword, date, clicks):
+    """ json of the identity and of the record of a row, as the stream encodes them """
+    return json.dumps([keyword, date]), json.dumps({'keywordId': keyword, 'date': date, 'clicks': clicks})
+
+
+class TestChangeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'keyword_1.digests')
+
+    def get_index(self, **options):
+        return ChangeIndex(self.path, **options)
+
+    def test_new_rows(self):
+        index = self.get_index()
+        self.assertTrue(index.is_new(*row(1, '2021-01-01', 10)))
+        self.assertTrue(index.is_new(*row(2, '2021-01-01', 10)))
+        self.assertTrue(index.is_new(*row(1, '2021-01-02', 10)))
+        # already written in this sync
+        self.assertFalse(index.is_new(*row(1, '2021-01-01', 10)))
+
+    def test_unchanged_rows_of_the_previous_sync(self):
+        index = self.get_index()
+        for keyword in range(10):
+            index.is_new(*row(keyword, '2021-01-01', 10))
+        index.save()
+
+        stats = SyncStats()
+        index = ChangeIndex(self.path, stats=stats)
+        written = [keyword for keyword in range(10) if index.is_new(*row(keyword, '2021-01-01', 10 + (keyword == 3)))]
+        index.save()
+        # same identity and a new content: written
+        self.assertEqual(written, [3])
+        self.assertEqual(stats.counters[('suppressed_rows', ())], 9)
+
+    def test_reverted_row_written_again(self):
+        for clicks, expected in ((10, True), (11, True), (10, True), (10, False)):
+            index = self.get_index()
+            self.assertEqual(index.is_new(*row(1, '2021-01-01', clicks)), expected, f'{clicks} clicks')
+            index.save()
+        self.assertEqual(len(index.keys), 1)
+
+    def test_without_identity(self):
+        index = self.get_index()
+        _, record = row(1, '2021-01-01', 10)
+        self.assertTrue(index.is_new(None, record))
+        self.assertFalse(index.is_new(None, record))
+        # a changed row is another row
+        self.assertTrue(index.is_new(*row(1, '2021-01-01', 11)))
+        self.assertEqual(index.filter([record, row(2, '2021-01-01', 10)[1]]), [row(2, '2021-01-01', 10)[1]])
+
+    def test_filter_with_identities(self):
+        index = self.get_index()
+        rows = [row(keyword, '2021-01-01', 10) for keyword in range(3)]
+        index.filter([record for _, record in rows], [identity for identity, _ in rows])
+        rows[1] = row(1, '2021-01-01', 12)
+        records = index.filter([record for _, record in rows], [identity for identity, _ in rows])
+        self.assertEqual(records, [rows[1][1]])
+
+    def test_not_saved(self):
+        """ A failed sync doesn't save the index: its rows are written again by the next one """
+        index = self.get_index()
+        index.is_new(*row(1, '2021-01-01', 10))
+        self.assertTrue(self.get_index().is_new(*row(1, '2021-01-01', 10)))
+
+    def test_merge(self):
+        with mock.patch.object(changes_module, 'MERGE_ROWS', 10):
+            index = self.get_index()
+            for keyword in range(25):
+                self.assertTrue(index.is_new(*row(keyword, '2021-01-01', 10)))
+            self.assertEqual(len(index.keys), 20)
+            self.assertEqual(len(index.written), 5)
+            # found in the sorted arrays and in the rows written since the merge
+            self.assertFalse(index.is_new(*row(3, '2021-01-01', 10)))
+            self.assertFalse(index.is_new(*row(22, '2021-01-01', 10)))
+            self.assertTrue(index.is_new(*row(3, '2021-01-01', 11)))
+            index.save()
+        self.assertEqual(os.path.getsize(self.path), 25 * changes_module.ENTRY.itemsize)
+        self.assertEqual(list(self.get_index().keys), sorted(index.keys))
+
+    def test_max_rows(self):
+        """ The rows not seen for the most syncs are dropped first """
+        index = self.get_index(max_rows=10)
+        for keyword in range(10):
+            index.is_new(*row(keyword, '2021-01-01', 10))
+        index.save()
+
+        index = self.get_index(max_rows=10)
+        # seen again, unchanged
+        for keyword in range(5):
+            self.assertFalse(index.is_new(*row(keyword, '2021-01-01', 10)))
+        for keyword in range(10, 15):
+            self.assertTrue(index.is_new(*row(keyword, '2021-01-01', 10)))
+        index.save()
+        self.assertEqual(len(index.keys), 10)
+
+        index = self.get_index(max_rows=10)
+        kept = [keyword for keyword in range(15) if not index.is_new(*row(keyword, '2021-01-01', 10))]
+        self.assertEqual(kept, list(range(5)) + list(range(10, 15)))
+
+
+class TestSyncChanges(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def sync(self, get_rows, directory, **options):
+        config = {**CONFIG, 'full_table_replication': True, 'change_index_dir': directory,
+                  'custom_report': [{'name': 'keyword', 'columns': ['keywordId', 'date', 'status']}], **options}
+        records, _ = sync(FakeClient(get_rows), config)
+        return records
+
+    def test_engines(self):
+        for options in ({}, {'parse_engine': 'pandas'}):
+            with self.subTest(**options):
+                directory = tempfile.mkdtemp(dir=self.directory)
+                statuses = {}
+
+                def get_rows(body, columns):
+                    rows = keyword_rows(body, columns)
+                    for line in rows:
+                        line[columns.index('status')] = statuses.get(line[columns.index('keywordId')], 'Active')
+                    return rows
+
+                self.assertEqual(len(self.sync(get_rows, directory, **options)), 5 * 60)
+                self.assertEqual(self.sync(get_rows, directory, **options), [])
+                statuses['2'] = 'Paused'
+                records = self.sync(get_rows, directory, **options)
+                self.assertEqual({record['keywordId'] for record in records}, {2})
+                self.assertEqual(len(records), 60)
+                # back to the content of the first sync
+                del statuses['2']
+                self.assertEqual(len(self.sync(get_rows, directory, **options)), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""
+    FilesReader: files read in parallel, returned in order, and stopped when the consumer fails.
+"""
+import threading
+import unittest
+from tap_searchads360.files import FilesReader
+from tap_searchads360.stats import SyncStats
+
+
+class FakeReader:
+    """ rows batches of the index of the file, started counts the files whose download was started """
+    started = 0
+    lock = threading.Lock()
+
+    def __init__(self, index, batches=3):
+        self.index = index
+        self.batches = batches
+        self.stats = SyncStats()
+
+    def read(self):
+        with FakeReader.lock:
+            FakeReader.started += 1
+        for batch in range(self.batches):
+            yield [[self.index, batch]], batch + 1
+
+
+def read(reader):
+    return reader.read()
+
+
+class TestFilesReader(unittest.TestCase):
+
+    def setUp(self):
+        FakeReader.started = 0
+
+    def test_files_in_order(self):
+        readers = [(index, FakeReader(index)) for index in range(20)]
+        rows = [row for _, batches in FilesReader(readers, max_workers=4, queue_size=1, read=read) for lines, _ in batches for row in lines]
+        self.assertEqual(rows, [[index, batch] for index in range(20) for batch in range(3)])
+        self.assertEqual(FakeReader.started, 20)
+
+    def test_failure_stops_the_next_files(self):
+        readers = [(index, FakeReader(index)) for index in range(20)]
+        with self.assertRaises(ValueError):
+            for index, batches in FilesReader(readers, max_workers=2, queue_size=1, read=read):
+                for lines, _ in batches:
+                    raise ValueError('write failed')
+        # the files already submitted to the workers, not the whole report
+        self.assertLessEqual(FakeReader.started, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
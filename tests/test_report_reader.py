@@ -0,0 +1,249 @@
+"""
+    ReportReader against a local http server that cuts the responses partway through and sometimes ignores Range:
+    the rows read must be the ones of the source file, whatever the interruptions.
+"""
+import csv
+import io
+import multiprocessing
+import resource
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import tap_searchads360.client as client_module
+from tap_searchads360.client import GoogleSearchAdsClient, ReportReader
+from tap_searchads360.files import read_batches
+
+ROWS = [['keywordId', 'keywordText', 'status']] + [
+    [str(i), 'é "quoted", with\na new line' if i % 7 == 0 else f'keyword {i}', 'Active'] for i in range(20000)
+]
+
+
+def get_content(rows):
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+CONTENT = get_content(ROWS)
+HEADER_BYTES = len(get_content(ROWS[:1]))
+GENERATED_BYTES = 2 * 1024 ** 3 # size of the generated file of the memory tests
+GENERATED_ROWS = get_content(ROWS[1:10001]) # repeated until GENERATED_BYTES
+MAX_MEMORY_MB = 64 # peak RSS added by reading the generated file
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """ Serves CONTENT: the first cut_requests responses stop after a third of their body, every other Range is ignored """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.headers.get('Range'))
+            count = len(server.requests)
+            cut = count <= server.cut_requests
+            ignore_range = server.ignore_range == 'always' or (server.ignore_range == 'sometimes' and count % 2 == 0)
+        start = int(self.headers['Range'][len('bytes='):-1]) if self.headers.get('Range') else 0
+        if start and not ignore_range:
+            body = CONTENT[start:]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}')
+        else:
+            body = CONTENT
+            self.send_response(200)
+        with server.lock:
+            server.statuses.append(206 if start and not ignore_range else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if cut:
+            self.wfile.write(body[:len(body) // 3])
+            self.wfile.flush()
+            # the client gets less than Content-Length
+            self.close_connection = True
+            self.connection.shutdown(2)
+        else:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestReportReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/files/report/0'
+        cls.client = GoogleSearchAdsClient('client_id', 'client_secret', access_token='token')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.serve(cut_requests=0, ignore_range='never')
+        # many chunks per response, the cuts fall in the middle of the rows
+        patcher = mock.patch.object(client_module, 'CHUNK_SIZE', 4096)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, cut_requests, ignore_range):
+        self.server.cut_requests = cut_requests
+        self.server.ignore_range = ignore_range
+        self.server.requests = []
+        self.server.statuses = []
+
+    def get_reader(self, offset=0):
+        return ReportReader(self.client, self.url, offset=offset)
+
+    def test_rows(self):
+        reader = self.get_reader()
+        self.assertEqual(list(reader), ROWS[1:])
+        self.assertEqual(reader.header, ROWS[0])
+        self.assertEqual(reader.offset, len(CONTENT))
+        self.assertEqual(self.server.requests, [None])
+
+    def test_rows_resumed_after_cuts(self):
+        self.serve(cut_requests=3, ignore_range='sometimes')
+        reader = self.get_reader()
+        self.assertEqual(list(reader), ROWS[1:])
+        self.assertEqual(reader.header, ROWS[0])
+        self.assertEqual(reader.offset, len(CONTENT))
+        # resumed from the offset of each cut, with and without a Range answer
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertTrue(all(self.server.requests[1:]))
+        self.assertIn(206, self.server.statuses[1:])
+        self.assertIn(200, self.server.statuses[1:])
+
+    def test_too_many_cuts(self):
+        self.serve(cut_requests=100, ignore_range='never')
+        reader = ReportReader(self.client, self.url, retries=2)
+        with self.assertRaises(client_module.DOWNLOAD_ERRORS):
+            list(reader)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_lines(self):
+        self.serve(cut_requests=3, ignore_range='sometimes')
+        reader = self.get_reader()
+        self.assertEqual(''.join(reader.lines()), CONTENT.decode('utf-8'))
+        self.assertEqual(reader.offset, len(CONTENT))
+
+    def test_blocks(self):
+        self.serve(cut_requests=3, ignore_range='sometimes')
+        reader = self.get_reader()
+        blocks = list(reader.blocks(10000))
+        self.assertEqual(reader.header, ROWS[0])
+        self.assertEqual(b''.join(blocks), CONTENT[HEADER_BYTES:])
+        self.assertEqual(reader.offset, len(CONTENT))
+        # each block has whole rows, the quoted new lines are kept with their row
+        rows = [row for block in blocks for row in csv.reader(io.StringIO(block.decode('utf-8')))]
+        self.assertEqual(rows, ROWS[1:])
+        self.assertGreater(len(blocks), 1)
+
+    def test_offset_with_range(self):
+        offset = len(get_content(ROWS[:1001]))
+        reader = self.get_reader(offset)
+        self.assertEqual(list(reader), ROWS[1001:])
+        self.assertIsNone(reader.header)
+        self.assertEqual(self.server.requests, [f'bytes={offset}-'])
+        self.assertEqual(self.server.statuses, [206])
+
+    def test_offset_range_ignored(self):
+        self.serve(cut_requests=2, ignore_range='always')
+        offset = len(get_content(ROWS[:1001]))
+        reader = self.get_reader(offset)
+        self.assertEqual(list(reader), ROWS[1001:])
+        self.assertEqual(reader.offset, len(CONTENT))
+        self.assertEqual(self.server.statuses, [200, 200, 200])
+
+    def test_resume_from_file_bytes(self):
+        """ A sync stopped after a checkpoint resumes from its file_bytes, file_rows rows already written """
+        self.serve(cut_requests=2, ignore_range='sometimes')
+        batches = read_batches(self.get_reader(), batch_rows=1000)
+        written = []
+        for _ in range(3):
+            lines, file_bytes = next(batches)
+            written.extend(lines)
+        file_rows = len(written)
+        batches.close()
+
+        reader = self.get_reader(file_bytes)
+        for lines, _ in read_batches(reader, batch_rows=1000):
+            written.extend(lines)
+        self.assertEqual(file_rows, 3000)
+        self.assertEqual(written, ROWS[1:])
+        self.assertEqual(reader.offset, len(CONTENT))
+
+    def test_resume_blocks_from_offset(self):
+        self.serve(cut_requests=2, ignore_range='sometimes')
+        reader = self.get_reader()
+        blocks = reader.blocks(10000)
+        read = [next(blocks), next(blocks)]
+        blocks.close()
+
+        resumed = self.get_reader(reader.offset)
+        read.extend(resumed.blocks(10000))
+        self.assertIsNone(resumed.header)
+        self.assertEqual(b''.join(read), CONTENT[HEADER_BYTES:])
+
+
+class GeneratedFile:
+    """ Client of a csv file of size bytes generated while it is downloaded, by chunks cut in the middle of the rows """
+    def __init__(self, size, chunk_size=1024 * 1024):
+        self.size = size
+        self.chunk_size = chunk_size
+
+    @property
+    def copies(self):
+        return self.size // len(GENERATED_ROWS)
+
+    def download(self, file_url, offset=0):
+        pending = get_content(ROWS[:1])
+        for _ in range(self.copies):
+            pending += GENERATED_ROWS
+            while len(pending) >= self.chunk_size:
+                yield pending[:self.chunk_size]
+                pending = pending[self.chunk_size:]
+        yield pending
+
+
+def read_generated(mode, size):
+    """ Read a generated file in a new process, return its rows (new lines of the blocks), the file offset and the peak RSS added in MB """
+    # kilobytes on linux
+    start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    reader = ReportReader(GeneratedFile(size), 'generated')
+    if mode == 'rows':
+        count = sum(1 for _ in reader)
+    else:
+        count = sum(block.count(b'\n') for block in reader.blocks())
+    return count, reader.offset, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start) / 1024
+
+
+class TestReportReaderMemory(unittest.TestCase):
+    """ A multi-GB file is parsed while it is downloaded, never held in memory """
+
+    def read_generated(self, mode):
+        # a process of its own: the peak RSS of this one includes the tests before
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            return pool.apply(read_generated, (mode, GENERATED_BYTES))
+
+    def test_rows_memory(self):
+        count, offset, memory = self.read_generated('rows')
+        copies = GeneratedFile(GENERATED_BYTES).copies
+        self.assertEqual(count, copies * 10000)
+        self.assertEqual(offset, HEADER_BYTES + copies * len(GENERATED_ROWS))
+        self.assertLess(memory, MAX_MEMORY_MB)
+
+    def test_blocks_memory(self):
+        count, offset, memory = self.read_generated('blocks')
+        copies = GeneratedFile(GENERATED_BYTES).copies
+        self.assertEqual(count, copies * GENERATED_ROWS.count(b'\n'))
+        self.assertEqual(offset, HEADER_BYTES + copies * len(GENERATED_ROWS))
+        self.assertLess(memory, MAX_MEMORY_MB)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+    Sync of SearchAdsStream against a fake client: the reports it requests and the records and bookmarks it writes.
+"""
+import contextlib
+import csv
+import io
+import json
+import unittest
+from datetime import datetime, timedelta
+from singer.catalog import Catalog
+import tap_searchads360
+from tap_searchads360.client import ReportReader
+from tap_searchads360.polling import ReportPoller
+from tap_searchads360.stats import SyncStats
+from tap_searchads360.streams import SearchAdsStream
+
+CONFIG = {'client_id': 'client_id', 'client_secret': 'client_secret', 'refresh_token': 'refresh_token', 'agency_id': 1,
+          'advertiser_id': ['1'], 'start_date': '2021-01-01T00:00:00Z', 'end_date': '2021-03-01'}
+
+
+def get_dates(body):
+    start = datetime.strptime(body['timeRange']['startDate'], '%Y-%m-%d')
+    end = datetime.strptime(body['timeRange']['endDate'], '%Y-%m-%d')
+    return [(start + timedelta(days=day)).strftime('%Y-%m-%d') for day in range((end - start).days + 1)]
+
+
+class FakeClient:
+    """
+        Reports generated from their request body by get_rows(body, columns), one file each, downloaded by chunks.
+        With fail_at, the download stops with an error at this byte of the file.
+    """
+    def __init__(self, get_rows, bodies=None, fail_at=None, chunk_size=4096):
+        self.get_rows = get_rows
+        self.stats = SyncStats()
+        # requests of a previous run, for its saved report ids
+        self.bodies = dict(bodies or {})
+        self.fail_at = fail_at
+        self.chunk_size = chunk_size
+
+    def request_report(self, body):
+        report_id = f'report{len(self.bodies)}'
+        self.bodies[report_id] = body
+        return report_id
+
+    def get_poller(self, max_workers=1):
+        return ReportPoller(self, first_delay=0, max_workers=max_workers)
+
+    def process_files(self, report_id):
+        return [{'url': f'files/{report_id}/0'}]
+
+    def download(self, file_url, offset=0):
+        body = self.bodies[file_url.split('/')[1]]
+        columns = [column['columnName'] for column in body['columns']]
+        output = io.StringIO()
+        csv.writer(output).writerows([columns] + self.get_rows(body, columns))
+        content = output.getvalue().encode('utf-8')
+        for start in range(offset, len(content), self.chunk_size):
+            if self.fail_at is not None and start + self.chunk_size > self.fail_at:
+                raise RuntimeError('sync interrupted')
+            yield content[start:start + self.chunk_size]
+
+    def extract_data(self, file_url, offset=0, stats=None):
+        return ReportReader(self, file_url, offset=offset, stats=stats)
+
+
+def sync(client, config, state=None, name='keyword', output=None):
+    """ Return the records and the last state written by a sync of the stream, the messages are also written to output """
+    catalog = Catalog.from_dict(tap_searchads360.get_catalog([SearchAdsStream(name, config=config)]))
+    for stream in catalog.streams:
+        for entry in stream.metadata:
+            if not entry['breadcrumb']:
+                entry['metadata']['selected'] = True
+    output = output or io.StringIO()
+    with contextlib.redirect_stdout(output):
+        tap_searchads360.sync(client, config, catalog, state or {})
+    return get_messages(output)
+
+
+def get_messages(output):
+    messages = [json.loads(line) for line in output.getvalue().splitlines()]
+    states = [message['value'] for message in messages if message['type'] == 'STATE']
+    return [message['record'] for message in messages if message['type'] == 'RECORD'], states[-1]
+
+
+def keyword_rows(body, columns):
+    # 5 keywords, a row per day with the date segment, a row for the whole range without it
+    dates = get_dates(body) if 'date' in columns else [None]
+    return [[str(keyword) if column == 'keywordId' else date for column in columns] for date in dates for keyword in range(5)]
+
+
+class TestReportSplit(unittest.TestCase):
+
+    def get_config(self, columns, **options):
+        return {**CONFIG, 'full_table_replication': True, 'custom_report': [{'name': 'keyword', 'columns': columns}], **options}
+
+    def get_state(self, rows_per_day):
+        return {'bookmarks': {'keyword': {'1': {'date': '2021-01-01T00:00:00Z', 'rows_per_day': rows_per_day, 'complete': True}}}}
+
+    def test_split_with_date(self):
+        client = FakeClient(keyword_rows)
+        _, state = sync(client, self.get_config(['keywordId', 'date'], rows_per_report=50), self.get_state(5))
+        days = [len(get_dates(body)) for body in client.bodies.values()]
+        self.assertEqual(days[:-1], [11] * (len(days) - 1))
+        # from every report, not the last and shortest one
+        self.assertLess(days[-1], 11)
+        self.assertEqual(state['bookmarks']['keyword']['1']['rows_per_day'], round(5 * sum(days) / (sum(days) - len(days)), 2))
+
+    def test_no_split_without_date(self):
+        client = FakeClient(keyword_rows)
+        records, state = sync(client, self.get_config(['keywordId', 'status'], rows_per_report=50), self.get_state(5))
+        # the rows are aggregated over the range, a split would only multiply them
+        self.assertEqual(len(client.bodies), 1)
+        self.assertEqual(len(records), 5)
+        self.assertEqual(state['bookmarks']['keyword']['1']['rows_per_day'], 5)
+
+
+def agency_rows(body, columns):
+    # 20 keywords per advertiser, advertiser 1 has the rows of january at the start of the file, 2 and 3 the ones of february
+    rows = []
+    for advertiser_id, month in (('1', '01'), ('2', '02'), ('3', '02')):
+        for day in range(1, 29):
+            for keyword in range(20):
+                values = {'keywordId': f'{advertiser_id}{keyword:03}', 'advertiserId': advertiser_id, 'lastModifiedTimestamp': f'2021-{month}-{day:02}'}
+                rows.append([values[column] for column in columns])
+    return rows
+
+
+class TestAgencyReport(unittest.TestCase):
+
+    def get_config(self, **options):
+        return {**CONFIG, 'agency_report': True, 'advertiser_id': [], 'end_date': '2021-03-01',
+                'custom_report': [{'name': 'keyword', 'columns': ['keywordId', 'lastModifiedTimestamp']}], **options}
+
+    def get_expected(self, state):
+        """ Rows after the bookmark of their advertiser """
+        columns = ['keywordId', 'lastModifiedTimestamp', 'advertiserId']
+        bookmarks = state.get('bookmarks', {}).get('keyword', {})
+        return [(int(row[0]), row[1]) for row in agency_rows(None, columns) if row[1] > bookmarks.get(row[2], {}).get('date', CONFIG['start_date'])[:10]]
+
+    def assert_bookmarks(self, state, dates):
+        bookmarks = state['bookmarks']['keyword']
+        self.assertEqual({advertiser_id: bookmarks[advertiser_id]['date'][:10] for advertiser_id in dates}, dates)
+        self.assertTrue(bookmarks['agency']['complete'])
+
+    def test_rows_split_by_advertiser(self):
+        state = {'bookmarks': {'keyword': {'2': {'date': '2021-02-20T00:00:00Z'}}}}
+        client = FakeClient(agency_rows)
+        records, state = sync(client, self.get_config(), state)
+        # a single report for the whole agency, the rows of advertiser 2 before its bookmark are skipped
+        self.assertEqual(len(client.bodies), 1)
+        self.assertNotIn('advertiserId', client.bodies['report0']['reportScope'])
+        self.assertEqual([(record['keywordId'], record['lastModifiedTimestamp'][:10]) for record in records],
+                         self.get_expected({'bookmarks': {'keyword': {'2': {'date': '2021-02-20'}}}}))
+        self.assert_bookmarks(state, {'1': '2021-01-28', '2': '2021-02-28', '3': '2021-02-28'})
+
+    def test_resume(self):
+        """ A sync interrupted after advertiser 1 resumes from its last checkpoint, without losing the dates of advertiser 1 """
+        config = self.get_config(checkpoint_rows=1000)
+        output = io.StringIO()
+        client = FakeClient(agency_rows, fail_at=len(get_content(agency_rows(None, ['keywordId', 'lastModifiedTimestamp', 'advertiserId']))) * 2 // 3)
+        with self.assertRaises(RuntimeError):
+            sync(client, config, output=output)
+        written, state = get_messages(output)
+        bookmark = state['bookmarks']['keyword']['agency']
+        self.assertFalse(bookmark['complete'])
+        # the rows of the batches before the error, the last checkpoint
+        self.assertEqual(bookmark['file_rows'], 1000)
+        self.assertEqual([(record['keywordId'], record['lastModifiedTimestamp'][:10]) for record in written], self.get_expected({})[:len(written)])
+        self.assertEqual(bookmark['max_dates']['1'][:10], '2021-01-28')
+
+        resumed = FakeClient(agency_rows, bodies=client.bodies)
+        records, state = sync(resumed, config, state)
+        # the saved report is read from the checkpoint, not requested again
+        self.assertEqual(len(resumed.bodies), 1)
+        self.assertEqual([(record['keywordId'], record['lastModifiedTimestamp'][:10]) for record in written + records], self.get_expected({}))
+        self.assert_bookmarks(state, {'1': '2021-01-28', '2': '2021-02-28', '3': '2021-02-28'})
+        self.assertNotIn('max_dates', state['bookmarks']['keyword']['agency'])
+
+
+def get_content(rows):
+    output = io.StringIO()
+    csv.writer(output).writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+if __name__ == '__main__':
+    unittest.main()